@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# fake_indexd.py — offline stand-in for the indexd_ffi SDK, used by publish.py and
+# gateway.py when run with --fake-indexd (or WACKAMOLE_FAKE_INDEXD=1).
+
+"""
+Implements the subset of the indexd_ffi surface the two scripts use — Sdk.upload /
+write / finalize, share_object, shared_object, download_shared — backed by a local
+directory, so uploads and downloads can be benchmarked end to end without a node.
+
+Objects are stored unencrypted as <dir>/<id>.bin with a <id>.json sidecar; the id
+is the SHA-256 of the content, so re-uploading the same bytes yields the same id.
+Share URLs keep the real shape (<base>/objects/<id>/shared?...#encryption_key=...).
+
+Shaping is configured through environment variables so both processes pick it up:
+
+  WACKAMOLE_FAKE_DIR          object store directory     ($TMPDIR/wackamole-fake-indexd)
+  WACKAMOLE_FAKE_LATENCY_MS   added to every SDK call    (0)
+  WACKAMOLE_FAKE_JITTER_MS    uniform extra latency      (0)
+  WACKAMOLE_FAKE_MIBPS        throughput cap per Sdk, shared by uploads and downloads (0 = none)
+  WACKAMOLE_FAKE_FAIL_RATE    probability a call raises FakeIndexdError (0)
+  WACKAMOLE_FAKE_FAIL_OPS     comma-separated calls that may fail (all); e.g. "read_at,write"
+  WACKAMOLE_FAKE_SEED         seed for jitter and failures
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import secrets
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+ENV = "WACKAMOLE_FAKE_INDEXD"
+
+WORDS = ("abandon ability able about above absent absorb abstract absurd abuse access accident "
+         "acid acoustic acquire across act action actor actress actual adapt add addict").split()
+
+class FakeIndexdError(RuntimeError):
+    pass
+
+class Logger:
+    def debug(self, msg): pass
+    def info(self, msg): pass
+    def warning(self, msg): pass
+    def error(self, msg): pass
+
+_LOGGER = Logger()
+
+def set_logger(logger, level=None):
+    global _LOGGER
+    _LOGGER = logger
+
+def generate_recovery_phrase() -> str:
+    return " ".join(secrets.choice(WORDS) for _ in range(12))
+
+class AppKey:
+    def __init__(self, mnemonic: str, app_id: bytes):
+        self.mnemonic = mnemonic
+        self.app_id = app_id
+
+class AppMeta:
+    def __init__(self, name, description, service_url, logo_url=None, callback_url=None):
+        self.name = name
+        self.description = description
+        self.service_url = service_url
+        self.logo_url = logo_url
+        self.callback_url = callback_url
+
+class UploadOptions:
+    def __init__(self, max_inflight=6, data_shards=10, parity_shards=20, metadata=None, progress_callback=None):
+        self.max_inflight = max_inflight
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        self.metadata = metadata
+        self.progress_callback = progress_callback
+
+class DownloadOptions:
+    def __init__(self, max_inflight=6, offset=0, length=None):
+        self.max_inflight = max_inflight
+        self.offset = offset
+        self.length = length
+
+# ==============================
+# Shaping (latency, throughput, failures)
+# ==============================
+
+def _env_float(name: str, default: float = 0.0) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+class Shaper:
+    """Per-Sdk latency, a shared token-bucket throughput cap and random failures."""
+
+    def __init__(self):
+        self.latency = _env_float("WACKAMOLE_FAKE_LATENCY_MS") / 1000
+        self.jitter = _env_float("WACKAMOLE_FAKE_JITTER_MS") / 1000
+        self.rate = _env_float("WACKAMOLE_FAKE_MIBPS") * (1 << 20)
+        self.fail_rate = _env_float("WACKAMOLE_FAKE_FAIL_RATE")
+        ops = os.environ.get("WACKAMOLE_FAKE_FAIL_OPS", "")
+        self.fail_ops = {o.strip() for o in ops.split(",") if o.strip()}
+        seed = os.environ.get("WACKAMOLE_FAKE_SEED")
+        self.rng = random.Random(seed) if seed is not None else random.Random()
+        self._next_free = 0.0   # when the throughput cap next has capacity
+
+    async def call(self, op: str, nbytes: int = 0) -> None:
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if nbytes and self.rate:
+            # Transfers queue behind each other, so concurrent calls share the cap.
+            now = time.monotonic()
+            start = max(now, self._next_free)
+            self._next_free = start + nbytes / self.rate
+            delay += self._next_free - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.fail_rate and (not self.fail_ops or op in self.fail_ops) and self.rng.random() < self.fail_rate:
+            raise FakeIndexdError(f"injected failure in {op}")
+
+# ==============================
+# Object store
+# ==============================
+
+def store_dir() -> Path:
+    d = Path(os.environ.get("WACKAMOLE_FAKE_DIR") or os.path.join(tempfile.gettempdir(), "wackamole-fake-indexd"))
+    d.mkdir(parents=True, exist_ok=True)
+    return d
+
+def _object_paths(object_id: str) -> tuple[Path, Path]:
+    if not object_id or not all(c in "0123456789abcdef" for c in object_id):
+        raise FakeIndexdError(f"invalid object id: {object_id!r}")
+    d = store_dir()
+    return d / f"{object_id}.bin", d / f"{object_id}.json"
+
+class PinnedObject:
+    def __init__(self, object_id: str, size: int, metadata: bytes | None):
+        self.id = object_id
+        self._size = size
+        self.metadata = metadata
+
+    def size(self) -> int:
+        return self._size
+
+    async def seal(self, app_key: AppKey) -> "PinnedObject":
+        return self
+
+class SharedObject:
+    def __init__(self, object_id: str, size: int, url: str):
+        self.id = object_id
+        self._size = size
+        self.url = url
+
+    def size(self) -> int:
+        return self._size
+
+class Upload:
+    """Buffers writes into a temp file in the store; finalize() names it by content hash."""
+
+    def __init__(self, sdk: "Sdk", options: UploadOptions):
+        self._sdk = sdk
+        self._options = options
+        self._sha = hashlib.sha256()
+        self._size = 0
+        self._tmp = store_dir() / f"upload-{os.getpid()}-{secrets.token_hex(6)}.part"
+        self._file = open(self._tmp, "wb")
+
+    async def write(self, chunk: bytes) -> None:
+        await self._sdk.shaper.call("write", len(chunk))
+        self._file.write(chunk)
+        self._sha.update(chunk)
+        self._size += len(chunk)
+        cb = self._options.progress_callback
+        if cb is not None:
+            (cb.progress if hasattr(cb, "progress") else cb)(self._size)
+
+    async def finalize(self) -> PinnedObject:
+        await self._sdk.shaper.call("finalize")
+        self._file.close()
+        object_id = self._sha.hexdigest()
+        data_path, meta_path = _object_paths(object_id)
+        os.replace(self._tmp, data_path)
+        meta = self._options.metadata
+        meta_path.write_text(json.dumps({
+            "size": self._size,
+            "metadata": meta.decode("utf-8", "replace") if isinstance(meta, bytes) else meta,
+            "data_shards": self._options.data_shards,
+            "parity_shards": self._options.parity_shards,
+        }), encoding="utf-8")
+        return PinnedObject(object_id, self._size, meta)
+
+class Download:
+    """Handle with both indexd_ffi shapes: sequential read_chunk() and ranged read_at()."""
+
+    def __init__(self, sdk: "Sdk", path: Path, offset: int, length: int, chunk_size: int = 1 << 20):
+        self._sdk = sdk
+        self._file = open(path, "rb")
+        self._start = offset
+        self._end = offset + length
+        self._pos = offset
+        self._chunk_size = chunk_size
+
+    def size(self) -> int:
+        return self._end - self._start
+
+    def _read(self, offset: int, n: int) -> bytes:
+        self._file.seek(offset)
+        return self._file.read(n)
+
+    async def read_chunk(self) -> bytes:
+        n = min(self._chunk_size, self._end - self._pos)
+        if n <= 0:
+            return b""
+        await self._sdk.shaper.call("read_chunk", n)
+        chunk = self._read(self._pos, n)
+        self._pos += len(chunk)
+        return chunk
+
+    async def read_at(self, offset: int, n: int) -> bytes:
+        n = max(0, min(n, self.size() - offset))
+        await self._sdk.shaper.call("read_at", n)
+        return self._read(self._start + offset, n)
+
+class Sdk:
+    def __init__(self, indexd_url: str, app_key: AppKey):
+        self.base = indexd_url.rstrip("/")
+        self.app_key = app_key
+        self.shaper = Shaper()
+
+    async def connected(self) -> bool:
+        return True
+
+    async def request_app_connection(self, meta: AppMeta):
+        raise FakeIndexdError("the fake indexd backend is always connected")
+
+    async def wait_for_connect(self, resp) -> bool:
+        return True
+
+    async def upload(self, options: UploadOptions) -> Upload:
+        await self.shaper.call("upload")
+        return Upload(self, options)
+
+    async def object(self, object_id: str) -> PinnedObject:
+        await self.shaper.call("object")
+        data_path, meta_path = _object_paths(object_id)
+        if not data_path.exists():
+            raise FakeIndexdError(f"object not found: {object_id}")
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        raw = meta.get("metadata")
+        return PinnedObject(object_id, meta["size"], raw.encode("utf-8") if isinstance(raw, str) else raw)
+
+    async def share_object(self, obj: PinnedObject, valid_until) -> str:
+        await self.shaper.call("share_object")
+        expires = int(valid_until.timestamp()) if hasattr(valid_until, "timestamp") else int(valid_until)
+        return f"{self.base}/objects/{obj.id}/shared?sv={expires}&sig=fake#encryption_key=fake"
+
+    async def shared_object(self, share_url: str) -> SharedObject:
+        await self.shaper.call("shared_object")
+        parts = [p for p in urlparse(share_url).path.split("/") if p]
+        if "objects" not in parts or parts.index("objects") + 1 >= len(parts):
+            raise FakeIndexdError(f"not a share URL: {share_url}")
+        object_id = parts[parts.index("objects") + 1]
+        data_path, _ = _object_paths(object_id)
+        if not data_path.exists():
+            raise FakeIndexdError(f"object not found: {object_id}")
+        return SharedObject(object_id, data_path.stat().st_size, share_url)
+
+    async def download_shared(self, ref: SharedObject, options: DownloadOptions | None = None) -> Download:
+        await self.shaper.call("download_shared")
+        data_path, _ = _object_paths(ref.id)
+        offset = getattr(options, "offset", 0) or 0
+        length = getattr(options, "length", None)
+        if length is None:
+            length = ref.size() - offset
+        return Download(self, data_path, offset, max(0, min(length, ref.size() - offset)))
@@ -36,20 +36,41 @@
 
 import argparse
 import asyncio
+import bisect
+import copy
+import fnmatch
+import hashlib
+import importlib.util
 import io
+import mmap
 import os
 import posixpath
+import re
 import secrets
+import socket
+import struct
 import sys
+import tempfile
+import threading
+import time
+import weakref
 import zipfile
+import zlib
 import json
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from sys import stdin
 from pathlib import Path, PurePosixPath
 from urllib.parse import urlparse
 from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from html.parser import HTMLParser
+from urllib.parse import unquote
 
-from fastapi import FastAPI, HTTPException, Response
-from fastapi.responses import HTMLResponse, PlainTextResponse
+from anyio import from_thread
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 import uvicorn
 
 try:
@@ -59,10 +80,20 @@ except Exception:
 
 from dotenv import load_dotenv, set_key
 
-from indexd_ffi import (
-    Sdk, AppKey, AppMeta, set_logger, Logger,
-    DownloadOptions, generate_recovery_phrase
-)
+# --fake-indexd (or WACKAMOLE_FAKE_INDEXD=1) swaps in the offline stand-in; the env var
+# is what --workers children see, so the flag is mirrored into it.
+if "--fake-indexd" in sys.argv:
+    os.environ["WACKAMOLE_FAKE_INDEXD"] = "1"
+if os.environ.get("WACKAMOLE_FAKE_INDEXD"):
+    from fake_indexd import (
+        Sdk, AppKey, AppMeta, set_logger, Logger,
+        DownloadOptions, generate_recovery_phrase
+    )
+else:
+    from indexd_ffi import (
+        Sdk, AppKey, AppMeta, set_logger, Logger,
+        DownloadOptions, generate_recovery_phrase
+    )
 
 class PrintLogger(Logger):
     def debug(self, msg): print("DEBUG", msg)
@@ -73,22 +104,60 @@ class PrintLogger(Logger):
 async def maybe_await(x):
     return await x if asyncio.iscoroutine(x) else x
 
-def _guess_mime(name: str) -> str:
-    low = name.lower()
-    if low.endswith((".html", ".htm")): return "text/html; charset=utf-8"
-    if low.endswith(".css"):            return "text/css; charset=utf-8"
-    if low.endswith(".js"):             return "application/javascript; charset=utf-8"
-    if low.endswith(".json"):           return "application/json; charset=utf-8"
-    if low.endswith(".svg"):            return "image/svg+xml"
-    if low.endswith(".png"):            return "image/png"
-    if low.endswith((".jpg",".jpeg")):  return "image/jpeg"
-    if low.endswith(".gif"):            return "image/gif"
-    if low.endswith(".webp"):           return "image/webp"
-    if low.endswith(".ico"):            return "image/x-icon"
-    if magic:
+MIME_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".htm": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".mjs": "application/javascript; charset=utf-8",
+    ".json": "application/json; charset=utf-8",
+    ".map": "application/json; charset=utf-8",
+    ".webmanifest": "application/manifest+json; charset=utf-8",
+    ".txt": "text/plain; charset=utf-8",
+    ".md": "text/markdown; charset=utf-8",
+    ".xml": "application/xml; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".ico": "image/x-icon",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+    ".ttf": "font/ttf",
+    ".otf": "font/otf",
+    ".wasm": "application/wasm",
+    ".pdf": "application/pdf",
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".mp3": "audio/mpeg",
+    ".ogg": "audio/ogg",
+    ".wav": "audio/wav",
+    ".zip": "application/zip",
+}
+SNIFF_BYTES = 2048
+_MAGIC = None
+_MAGIC_LOCK = threading.Lock()   # libmagic handles are not thread-safe
+
+def _guess_mime(name: str) -> str | None:
+    """Extension lookup only; None means the member needs content sniffing."""
+    dot = name.rfind(".")
+    if dot < 0 or "/" in name[dot:]:
+        return None
+    return MIME_TYPES.get(name[dot:].lower())
+
+def _sniff_mime(head: bytes) -> str:
+    global _MAGIC
+    if magic and head:
         try:
-            m = magic.Magic(mime=True)
-            return m.from_buffer(b"") or "application/octet-stream"
+            with _MAGIC_LOCK:
+                if _MAGIC is None:
+                    _MAGIC = magic.Magic(mime=True)
+                mime = _MAGIC.from_buffer(head)
+            if mime:
+                return mime + "; charset=utf-8" if mime.startswith("text/") else mime
         except Exception:
             pass
     return "application/octet-stream"
@@ -132,165 +201,1301 @@ def _load_manifest(path: Path) -> tuple[str | None, str | None]:
     except Exception:
         return None, None
 
-app = FastAPI()
-ZIP = None               # type: zipfile.ZipFile | None
-ZIP_SET = set()
-ETAG = 'W/"boot"'
-STARTED_AT = datetime.now(timezone.utc).isoformat()
+class MemberCache:
+    """
+    Byte-budgeted LRU of decompressed zip members, so hot files are inflated once
+    instead of on every hit. Keys are (archive key, member name), so every loaded
+    site shares one budget. Members matching a pin pattern (and no larger than
+    pin_max_bytes) are never evicted; they count against max_bytes and may take up
+    to half of it, after which further matches are cached in the LRU like the rest.
+    """
+
+    def __init__(self, max_bytes: int, *, pin_patterns: tuple[str, ...] = (), pin_max_bytes: int = 64 * 1024):
+        self.max_bytes = max(0, max_bytes)
+        self.max_item_bytes = self.max_bytes // 4   # one big member must not flush the whole cache
+        self.max_pinned_bytes = self.max_bytes // 2 # pins must leave the LRU room to work
+        self.pin_patterns = tuple(pin_patterns)
+        self.pin_max_bytes = pin_max_bytes
+        self._lock = threading.Lock()
+        self._lru: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self._pinned: dict[tuple[str, str], bytes] = {}
+        self.lru_bytes = 0
+        self.pinned_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def _is_pinned(self, name: str, size: int) -> bool:
+        return size <= self.pin_max_bytes and any(fnmatch.fnmatchcase(name, p) for p in self.pin_patterns)
+
+    def get(self, key: tuple[str, str]) -> bytes | None:
+        with self._lock:
+            data = self._pinned.get(key)
+            if data is None:
+                data = self._lru.get(key)
+                if data is not None:
+                    self._lru.move_to_end(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def put(self, key: tuple[str, str], data: bytes) -> None:
+        size = len(data)
+        with self._lock:
+            if key in self._pinned or key in self._lru:
+                return
+            if self._is_pinned(key[1], size) and self.pinned_bytes + size <= self.max_pinned_bytes:
+                self._pinned[key] = data
+                self.pinned_bytes += size
+                return
+            if size > self.max_item_bytes:
+                return
+            self._lru[key] = data
+            self.lru_bytes += size
+            while self.lru_bytes + self.pinned_bytes > self.max_bytes and self._lru:
+                _, old = self._lru.popitem(last=False)
+                self.lru_bytes -= len(old)
+                self.evictions += 1
+                self.evicted_bytes += len(old)
+
+    def discard(self, archive_key: str) -> None:
+        """Drop every entry belonging to an archive that is no longer served."""
+        with self._lock:
+            for key in [k for k in self._lru if k[0] == archive_key]:
+                self.lru_bytes -= len(self._lru.pop(key))
+            for key in [k for k in self._pinned if k[0] == archive_key]:
+                self.pinned_bytes -= len(self._pinned.pop(key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "pinned": len(self._pinned),
+                "bytes": self.lru_bytes,
+                "pinned_bytes": self.pinned_bytes,
+                "max_pinned_bytes": self.max_pinned_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+# ==============================
+# Metrics (Prometheus text format on /__metrics)
+# ==============================
+
+class Metrics:
+    """
+    Request, decompression and download counters. Each thread writes its own shard
+    without locking; /__metrics sums the shards on scrape, so the serving path never
+    contends. The lock is only taken when a thread registers its shard.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        self._lock = threading.Lock()
+        # site → {pack: (seconds, bytes)} of its last load; pack is "" for a plain archive,
+        # "index" and the pack numbers for an incremental site.
+        self.downloads: dict[str, dict[str, tuple[float, int]]] = {}
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {"requests": {}, "latency": {}, "bytes": {}, "inflate": [0, 0.0, 0]}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe_request(self, route: str, status: int, seconds: float, sent: int) -> None:
+        shard = self._shard()
+        requests, latency, sent_bytes = shard["requests"], shard["latency"], shard["bytes"]
+        key = (route, status)
+        requests[key] = requests.get(key, 0) + 1
+        hist = latency.get(route)
+        if hist is None:
+            hist = latency[route] = [[0] * (len(self.BUCKETS) + 1), 0.0]
+        hist[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        sent_bytes[route] = sent_bytes.get(route, 0) + sent
+
+    def observe_inflate(self, seconds: float, nbytes: int) -> None:
+        inflate = self._shard()["inflate"]
+        inflate[0] += 1
+        inflate[1] += seconds
+        inflate[2] += nbytes
+
+    def observe_download(self, name: str, seconds: float, nbytes: int) -> None:
+        """name is a Site name; pack downloads come as "<site>#pack<n>" (see _pack_site)."""
+        site, _, pack = name.partition("#")
+        pack = pack.removeprefix("pack")
+        with self._lock:
+            if pack in ("", "index") or site not in self.downloads:
+                self.downloads[site] = {}   # a new load: earlier figures describe a replaced archive
+            self.downloads[site][pack] = (seconds, nbytes)
+
+    def forget_downloads(self, site: str) -> None:
+        with self._lock:
+            self.downloads.pop(site, None)
+
+    def download_figures(self) -> list[tuple[dict, float, int]]:
+        """(labels, seconds, bytes) per site, and per pack for incremental sites."""
+        with self._lock:
+            return [({"site": site, **({"pack": pack} if pack else {})}, t, n)
+                    for site, packs in sorted(self.downloads.items()) for pack, (t, n) in sorted(packs.items())]
+
+    def snapshot(self) -> dict:
+        """Sum of all shards (dict copies are atomic under the GIL, so writers never block)."""
+        with self._lock:
+            shards = list(self._shards)
+        requests, latency, sent_bytes, inflate = {}, {}, {}, [0, 0.0, 0]
+        for shard in shards:
+            for key, n in shard["requests"].copy().items():
+                requests[key] = requests.get(key, 0) + n
+            for route, (counts, total) in shard["latency"].copy().items():
+                agg = latency.setdefault(route, [[0] * (len(self.BUCKETS) + 1), 0.0])
+                agg[0] = [a + b for a, b in zip(agg[0], list(counts))]
+                agg[1] += total
+            for route, n in shard["bytes"].copy().items():
+                sent_bytes[route] = sent_bytes.get(route, 0) + n
+            inflate = [a + b for a, b in zip(inflate, list(shard["inflate"]))]
+        return {"requests": requests, "latency": latency, "bytes": sent_bytes, "inflate": inflate}
+
+METRICS = Metrics()
+
+class _MetricsMiddleware:
+    """Plain ASGI wrapper: times each response to its last body chunk and counts bytes sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status, sent = 500, 0
+
+        async def send_counted(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_counted)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            METRICS.observe_request(route, status, time.perf_counter() - t0, sent)
+
+def _prom_labels(**labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in labels.items())
+    return "{" + body + "}"
+
+def render_metrics() -> str:
+    snap = METRICS.snapshot()
+    out = []
+
+    def metric(name: str, kind: str, help_text: str, samples) -> None:
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            out.append(f"{name}{suffix}{_prom_labels(**labels)} {value}")
+
+    metric("wackamole_http_requests_total", "counter", "HTTP responses by route and status code.",
+           [("", {"route": r, "code": c}, n) for (r, c), n in sorted(snap["requests"].items())])
+    hist = []
+    for route, (counts, total) in sorted(snap["latency"].items()):
+        running = 0
+        for le, n in zip(Metrics.BUCKETS + ("+Inf",), counts):
+            running += n
+            hist.append(("_bucket", {"route": route, "le": le}, running))
+        hist.append(("_sum", {"route": route}, round(total, 6)))
+        hist.append(("_count", {"route": route}, running))
+    metric("wackamole_http_request_duration_seconds", "histogram",
+           "Time from request to the last response byte, by route.", hist)
+    metric("wackamole_http_response_bytes_total", "counter", "Response body bytes sent, by route.",
+           [("", {"route": r}, n) for r, n in sorted(snap["bytes"].items())])
+
+    calls, seconds, nbytes = snap["inflate"]
+    metric("wackamole_inflate_total", "counter", "Member decompressions (whole reads and streamed ranges).",
+           [("", {}, calls)])
+    metric("wackamole_inflate_seconds_total", "counter", "Time spent decompressing members.",
+           [("", {}, round(seconds, 6))])
+    metric("wackamole_inflate_bytes_total", "counter", "Decompressed bytes produced.", [("", {}, nbytes)])
+
+    cache = CACHE.stats()
+    metric("wackamole_cache_hits_total", "counter", "Member cache hits.", [("", {}, cache["hits"])])
+    metric("wackamole_cache_misses_total", "counter", "Member cache misses.", [("", {}, cache["misses"])])
+    metric("wackamole_cache_hit_ratio", "gauge", "Member cache hits / lookups.", [("", {}, cache["hit_ratio"])])
+    metric("wackamole_cache_bytes", "gauge", "Bytes held by the member cache (LRU + pinned).",
+           [("", {}, cache["bytes"] + cache["pinned_bytes"])])
+    metric("wackamole_cache_evictions_total", "counter", "Member cache evictions.", [("", {}, cache["evictions"])])
+
+    sites = [s for s in POOL.sites.values() if s.archive is not None]
+    metric("wackamole_archive_bytes", "gauge", "Size of the loaded archive.",
+           [("", {"site": s.name}, s.archive.src.size) for s in sites])
+    metric("wackamole_archive_entries", "gauge", "Files in the loaded archive.",
+           [("", {"site": s.name}, len(s.archive.files)) for s in sites])
+    metric("wackamole_archive_resident_bytes", "gauge", "Archive bytes held on the heap.",
+           [("", {"site": s.name}, s.archive.resident_bytes) for s in sites])
+
+    downloads = METRICS.download_figures()
+    metric("wackamole_download_seconds", "gauge", "Duration of the last archive download, by site (and pack).",
+           [("", labels, round(t, 3)) for labels, t, n in downloads])
+    metric("wackamole_download_bytes", "gauge", "Size of the last archive download, by site (and pack).",
+           [("", labels, n) for labels, t, n in downloads])
+    metric("wackamole_download_bytes_per_second", "gauge", "Throughput of the last archive download.",
+           [("", labels, round(n / t) if t else 0) for labels, t, n in downloads])
+    return "\n".join(out) + "\n"
+
+WORKER_ENV = "WACKAMOLE_WORKER_ARGS"   # set by the pre-fork parent for --workers children
+
+# ==============================
+# Readiness (systemd notify)
+# ==============================
+
+def sd_notify(state: str) -> bool:
+    """Send a state line (e.g. "READY=1") to systemd; a no-op outside a Type=notify unit."""
+    addr = os.environ.get("NOTIFY_SOCKET")
+    if not addr or not hasattr(socket, "AF_UNIX"):
+        return False
+    if addr.startswith("@"):
+        addr = "\0" + addr[1:]   # abstract namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as s:
+            s.connect(addr)
+            s.sendall(state.encode("utf-8"))
+        return True
+    except OSError as e:
+        print(f"WARN: sd_notify failed: {e}")
+        return False
+
+_READY_LOCK = threading.Lock()
+_READY_PARTS: set[str] = set()
+
+def _mark_ready(part: str) -> None:
+    # READY=1 goes out once, when the server is up and the archive is loaded (either order).
+    with _READY_LOCK:
+        if "notified" in _READY_PARTS:
+            return
+        _READY_PARTS.add(part)
+        if not {"serving", "loaded"} <= _READY_PARTS:
+            return
+        _READY_PARTS.add("notified")
+    sd_notify("READY=1\nSTATUS=Serving")
+
+@asynccontextmanager
+async def _lifespan(app):
+    # Lifespan startup runs before uvicorn binds the socket, so "serving" is marked by
+    # run_server() instead.
+    if os.environ.get(WORKER_ENV):
+        _init_worker(json.loads(os.environ[WORKER_ENV]))
+    yield
+
+class _NotifyingServer(uvicorn.Server):
+    async def startup(self, sockets=None) -> None:
+        await super().startup(sockets=sockets)
+        if self.started:    # the listening socket is bound now
+            _mark_ready("serving")
+
+def run_server(target, args, *, workers: int = 1, app_dir: str | None = None) -> None:
+    """
+    uvicorn.run() for this gateway: READY=1 (see _mark_ready) waits for the listening
+    socket, not just lifespan startup. With workers > 1 the supervisor binds the socket
+    here before forking, and target must be an import string.
+    """
+    if app_dir is not None:
+        sys.path.insert(0, app_dir)
+    protocol = {"http": "zttp", "http2": True} if args.http2 else {}
+    config = uvicorn.Config(target, host=args.host, port=args.port, workers=workers,
+                            ssl_certfile=args.ssl_certfile, ssl_keyfile=args.ssl_keyfile, **protocol)
+    if config.workers > 1:
+        from uvicorn.supervisors import Multiprocess
+        sock = config.bind_socket()
+        sock.listen(config.backlog)    # connections queue until a worker accepts them
+        _mark_ready("serving")
+        Multiprocess(config, sockets=[sock]).run()
+        return
+    server = _NotifyingServer(config)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    if not server.started:
+        sys.exit(1)
+
+app = FastAPI(lifespan=_lifespan)
+app.add_middleware(_MetricsMiddleware)
 DEFAULT_INDEXES = ("index.html","index.htm")
+CACHE = MemberCache(64 << 20)
+STREAM_THRESHOLD = 1 << 20   # members larger than this are streamed, never held whole
+CHUNK_SIZE = 256 << 10       # streaming chunk; bounds per-request memory
 
-def build_index(zf: zipfile.ZipFile) -> set[str]:
-    items = set()
+def build_index(zf: zipfile.ZipFile) -> tuple[set[str], dict[str, str]]:
+    """
+    Returns (files, dirs): the set of member paths, and a route table mapping each
+    directory (explicit entries and implied parents alike) that has an index document
+    to that document, so directory requests and 404s are a single dict lookup.
+    """
+    files = set()
+    dirs = {"": None}
     for n in zf.namelist():
-        n2 = n.replace("\\","/").rstrip("/")
-        if n2:
-            items.add(n2)
-    return items
+        n2 = n.replace("\\","/")
+        is_dir = n2.endswith("/")
+        n2 = n2.rstrip("/")
+        if not n2:
+            continue
+        if is_dir:
+            dirs.setdefault(n2, None)
+        else:
+            files.add(n2)
+        parent = n2.rpartition("/")[0]
+        while parent not in dirs:
+            dirs[parent] = None
+            parent = parent.rpartition("/")[0]
+    routes = {}
+    for d in dirs:
+        idx = find_index(d, files)
+        if idx:
+            routes[d] = idx
+    return files, routes
 
-def find_index(prefix: str) -> str | None:
+def find_index(prefix: str, files: set[str]) -> str | None:
     prefix = prefix.rstrip("/")
     for ix in DEFAULT_INDEXES:
         cand = (prefix + "/" + ix) if prefix else ix
-        if cand in ZIP_SET:
+        if cand in files:
             return cand
     return None
 
+class SiteArchive:
+    """One opened site zip plus the tables derived from it at load time."""
+
+    def __init__(self, zf: zipfile.ZipFile, src, etag: str, fingerprinted: frozenset[str] | None = None):
+        self.zf = zf
+        self.src = src                # archive source with the raw bytes (read_at)
+        self.etag = etag              # archive-wide fingerprint; also the cache namespace
+        # members publish.py --fingerprint renamed; None when the archive does not say
+        self.fingerprinted = fingerprinted if fingerprinted is not None else recorded_fingerprints(zf.comment)
+        self.files, self.dirs = build_index(zf)
+        self.data_offsets: dict[str, int] = {}
+        # Sniffing reads member bytes, so lazily fetched archives defer it to first request.
+        local = _source_is_local(src)
+        self.mimes = build_mime_index(self, sniff=local)
+        # page → preload Link values; lazily fetched archives scan each page on first request.
+        self.preloads = build_preload_index(self) if local else {}
+        self.cache_controls: dict[str, str] = {}   # memoized Cache-Control per member
+        # bytes held on the Python heap
+        self.resident_bytes = src.size if src.resident else getattr(src, "resident_bytes", 0)
+
+class Site:
+    """A share URL served by this gateway; `archive` is None until (re)fetched."""
+
+    def __init__(self, name: str, share_url: str | None = None, indexd: str | None = None, hosts: tuple[str, ...] = ()):
+        self.name = name
+        self.share_url = share_url
+        self.indexd = indexd
+        self.hosts = tuple(h.lower() for h in hosts)
+        self.archive: SiteArchive | None = None
+        self.load_lock = threading.Lock()
+        self.last_error: str | None = None
+        self.retry_at = 0.0                    # monotonic; on-demand loads wait until then after a failure
+        self.retry_delay = 0.0
+        self.manifest: Path | None = None      # watched for republishes (hot swap)
+        self.control_url: str | None = None    # polled for republishes (hot swap)
+
+def _host_name(host: str | None) -> str:
+    host = (host or "").strip().lower()
+    if host.startswith("["):
+        return host[:host.find("]") + 1]
+    return host.rsplit(":", 1)[0]
+
+class ArchivePool:
+    """
+    Sites served by this gateway and the archives loaded for them. Loaded archives
+    are accounted by resident size and evicted least-recently-used once the pool
+    exceeds its budget; an evicted site is fetched again on its next request.
+    With a single site every request goes to it; otherwise requests are routed by
+    Host header, then by a leading /<site-name>/ path segment.
+    """
+
+    def __init__(self, budget_bytes: int = 0):
+        self.budget_bytes = budget_bytes      # 0 = unlimited
+        self.loader = None                    # callable(Site) -> SiteArchive
+        self.sites: dict[str, Site] = {}
+        self.hosts: dict[str, Site] = {}
+        self._lock = threading.Lock()
+        self._lru: OrderedDict[str, None] = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def multi(self) -> bool:
+        return len(self.sites) > 1
+
+    def add(self, site: Site) -> Site:
+        if site.name in self.sites or site.name.startswith("__") or "/" in site.name:
+            raise ValueError(f"invalid or duplicate site name: {site.name!r}")
+        self.sites[site.name] = site
+        for h in site.hosts:
+            self.hosts[h] = site
+        return site
+
+    def single(self) -> Site:
+        if not self.sites:
+            self.add(Site("default"))
+        return next(iter(self.sites.values()))
+
+    def route(self, host: str | None, path: str) -> tuple[Site | None, str | None]:
+        """Returns (site, path within the site); path is None for a bare /<site> prefix."""
+        if not self.multi:
+            return self.single(), path
+        site = self.hosts.get(_host_name(host))
+        if site is not None:
+            return site, path
+        first, sep, rest = path.lstrip("/").partition("/")
+        site = self.sites.get(first)
+        if site is not None:
+            return site, (rest if sep else None)
+        return None, path
+
+    def get(self, site: Site) -> SiteArchive | None:
+        arc = site.archive
+        if arc is None and self.loader is not None:
+            if time.monotonic() < site.retry_at:
+                return None                   # failed recently: answer 503 without another fetch
+            with site.load_lock:              # one fetch per site, however many requests wait
+                arc = site.archive
+                if arc is None:
+                    if time.monotonic() < site.retry_at:
+                        return None
+                    try:
+                        arc = self.loader(site)
+                    except Exception as e:
+                        # Back off as load_in_background does: 1s, doubling up to 60s.
+                        site.retry_delay = min(60.0, site.retry_delay * 2 or 1.0)
+                        site.retry_at = time.monotonic() + site.retry_delay
+                        site.last_error = f"{type(e).__name__}: {e}"
+                        print(f"ERROR: loading site {site.name!r} failed: {site.last_error}; "
+                              f"next attempt in {site.retry_delay:.0f}s")
+                        return None
+                    site.last_error = None
+                    site.retry_delay = site.retry_at = 0.0
+                    self.install(site, arc)
+        if arc is not None:
+            with self._lock:
+                if site.name in self._lru:
+                    self._lru.move_to_end(site.name)
+        return arc
+
+    def install(self, site: Site, arc: SiteArchive) -> None:
+        with self._lock:
+            old = site.archive
+            site.archive = arc
+            self._lru[site.name] = None
+            self._lru.move_to_end(site.name)
+            self.loads += 1
+            released = [old] if old is not None and old is not arc else []
+            if self.budget_bytes:
+                total = sum(s.archive.resident_bytes for s in self.sites.values() if s.archive is not None)
+                for name in list(self._lru):
+                    if total <= self.budget_bytes:
+                        break
+                    if name == site.name:
+                        continue
+                    victim = self.sites[name]
+                    if victim.archive is None:
+                        continue
+                    total -= victim.archive.resident_bytes
+                    released.append(victim.archive)
+                    victim.archive = None
+                    del self._lru[name]
+                    METRICS.forget_downloads(name)
+                    self.evictions += 1
+                    print(f"Pool: evicted site {name!r} (pool {total}/{self.budget_bytes} bytes)")
+        for old in released:
+            _release_archive(old, keep=arc)
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = [s for s in self.sites.values() if s.archive is not None]
+            return {
+                "sites": len(self.sites),
+                "loaded": len(loaded),
+                "bytes": sum(s.archive.resident_bytes for s in loaded),
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+POOL = ArchivePool()
+
+def _release_archive(arc: SiteArchive, *, keep: SiteArchive | None = None) -> None:
+    # Streams still holding `arc` keep working; only derived caches are dropped.
+    if keep is not None and keep.etag == arc.etag:
+        return
+    if any(s.archive is not None and s.archive.etag == arc.etag for s in POOL.sites.values()):
+        return
+    CACHE.discard(arc.etag)
+    SEEK_INDEX.discard(arc.etag)
+
 @app.get("/__health", response_class=PlainTextResponse)
 def health():
-    if ZIP is None:
-        raise HTTPException(503, "zip not loaded")
-    probes = ["index.html","index.htm","favicon.ico"]
-    lines = [f"{p}: {'ok' if (p in ZIP_SET or any(x.startswith(p) for x in ZIP_SET)) else 'missing'}" for p in probes]
+    if not POOL.multi:
+        arc = POOL.single().archive
+        if arc is None:
+            raise HTTPException(503, "zip not loaded")
+        probes = ["index.html","index.htm","favicon.ico"]
+        lines = [f"{p}: {'ok' if p in arc.files else 'missing'}" for p in probes]
+        lines.append(f"archive: {arc.etag}")
+    else:
+        lines = []
+        for site in POOL.sites.values():
+            arc = site.archive
+            state = f"loaded ({len(arc.files)} entries, {arc.etag})" if arc else "not loaded"
+            if site.last_error:
+                state += f" last error: {site.last_error}"
+            lines.append(f"site {site.name}: {state}")
+        lines.append("pool: " + " ".join(f"{k}={v}" for k, v in POOL.stats().items()))
+    lines.append("cache: " + " ".join(f"{k}={v}" for k, v in CACHE.stats().items()))
     return "ok\n" + "\n".join(lines)
 
+@app.get("/__live", response_class=PlainTextResponse)
+def live():
+    # Liveness: the process answers. Loading, failed downloads and retries do not count against it.
+    return "ok"
+
+@app.get("/__ready", response_class=PlainTextResponse)
+def ready():
+    # Readiness: every site can serve. Multi-site pools load on demand, so they are ready at once.
+    if not POOL.sites:
+        raise HTTPException(503, "no site configured")
+    if POOL.multi:
+        return f"ready ({len(POOL.sites)} sites)"
+    site = POOL.single()
+    if site.archive is None:
+        detail = f"loading; last error: {site.last_error}" if site.last_error else "loading"
+        raise HTTPException(503, detail)
+    return f"ready ({len(site.archive.files)} entries, {site.archive.etag})"
+
+@app.get("/__metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/{rest:path}")
-def serve(rest: str):
-    if ZIP is None:
-        raise HTTPException(503, "archive not ready")
+def serve(rest: str, request: Request):
+    site, rest = POOL.route(request.headers.get("host"), rest)
+    if site is None:
+        raise HTTPException(404, "Unknown site")
+    if rest is None:
+        # Bare /<site> prefix: redirect so relative links resolve inside the site.
+        return RedirectResponse(f"/{site.name}/", status_code=308)
+    arc = POOL.get(site)
+    if arc is None:
+        wait = site.retry_at - time.monotonic()
+        raise HTTPException(503, "archive not ready",
+                            headers={"Retry-After": str(int(wait) + 1)} if wait > 0 else None)
     path = _norm_path(rest)
 
     if path == "":
-        idx = find_index("")
+        idx = arc.dirs.get("")
         if not idx:
             return HTMLResponse("<h1>No index.html in archive</h1>", status_code=404)
-        return _serve_member(idx)
+        return _serve_member(arc, idx, request)
 
-    if path in ZIP_SET:
-        return _serve_member(path)
+    if path in arc.files:
+        return _serve_member(arc, path, request)
 
-    if any(n.startswith(path + "/") for n in ZIP_SET):
-        idx = find_index(path)
-        if idx:
-            return _serve_member(idx)
+    idx = arc.dirs.get(path)
+    if idx:
+        return _serve_member(arc, idx, request)
 
     raise HTTPException(404, f"Not found: /{path}")
 
-def _serve_member(name: str):
+def _member_head(arc: SiteArchive, name: str) -> bytes:
+    with arc.zf.open(name) as f:
+        return f.read(SNIFF_BYTES)
+
+def build_mime_index(arc: SiteArchive, *, sniff: bool) -> dict[str, str | None]:
+    mimes = {}
+    for n in arc.files:
+        mime = _guess_mime(n)
+        if mime is None and sniff:
+            mime = _sniff_mime(_member_head(arc, n))
+        mimes[n] = mime
+    return mimes
+
+def _member_mime(arc: SiteArchive, name: str) -> str:
+    # Deferred sniff (lazy archives): read the member's first bytes once, then memoize.
+    mime = _sniff_mime(_member_head(arc, name))
+    arc.mimes[name] = mime
+    return mime
+
+def _read_member(arc: SiteArchive, name: str) -> bytes:
+    key = (arc.etag, name)
+    data = CACHE.get(key)
+    if data is None:
+        t0 = time.perf_counter()
+        data = arc.zf.read(name)
+        METRICS.observe_inflate(time.perf_counter() - t0, len(data))
+        CACHE.put(key, data)
+    return data
+
+# ==============================
+# Preload hints (Link headers / 103 Early Hints)
+# ==============================
+
+PRELOAD_MAX = 8               # subresources hinted per page
+PRELOAD_SCAN_BYTES = 64 << 10 # only the top of a page is scanned; critical assets sit there
+EARLY_HINTS = False           # also send them as a 103 response (--early-hints)
+
+class _AssetScanner(HTMLParser):
+    """Collects a page's render-critical subresources, in document order, as (href, rel, as)."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found: list[tuple[str, str, str | None]] = []
+
+    def handle_starttag(self, tag, attrs):
+        a = {k: v or "" for k, v in attrs}
+        if tag == "link":
+            rels = a.get("rel", "").lower().split()
+            if "stylesheet" in rels and "alternate" not in rels and a.get("href"):
+                self.found.append((a["href"], "preload", "style"))
+        elif tag == "script" and a.get("src"):
+            if a.get("type", "").lower() == "module":
+                self.found.append((a["src"], "modulepreload", None))
+            else:
+                self.found.append((a["src"], "preload", "script"))
+        elif tag == "img" and a.get("src"):
+            # Inline-size logos/icons (SVG) and images the page marks as high priority.
+            src = a["src"]
+            if src.split("?", 1)[0].lower().endswith(".svg") or a.get("fetchpriority", "").lower() == "high":
+                self.found.append((src, "preload", "image"))
+
+def _preload_target(page: str, href: str) -> str | None:
+    """Archive member an href on `page` points at, or None for external/data URLs."""
+    u = urlparse(href)
+    if u.scheme or u.netloc or not u.path:
+        return None
+    base = "" if u.path.startswith("/") else posixpath.dirname(page)
+    return _norm_path(posixpath.join(base, unquote(u.path).lstrip("/")))
+
+def _page_preloads(arc: SiteArchive, page: str) -> tuple[str, ...]:
+    with arc.zf.open(page) as f:
+        head = f.read(PRELOAD_SCAN_BYTES)
+    scanner = _AssetScanner()
+    try:
+        scanner.feed(head.decode("utf-8", "replace"))
+    except Exception:
+        pass   # malformed markup: keep whatever was found before it
+    links, seen = [], set()
+    for href, rel, kind in scanner.found:
+        href = href.split("#", 1)[0].strip()
+        # Only hint members that exist, with the URL exactly as the page will request it.
+        if href in seen or not href.isascii() or any(c in href for c in '<> "') \
+                or _preload_target(page, href) not in arc.files:
+            continue
+        seen.add(href)
+        links.append(f"<{href}>; rel={rel}" + (f"; as={kind}" if kind else ""))
+        if len(links) >= PRELOAD_MAX:
+            break
+    return tuple(links)
+
+def _is_html(mime: str | None) -> bool:
+    return bool(mime) and mime.startswith("text/html")
+
+def build_preload_index(arc: SiteArchive) -> dict[str, tuple[str, ...]]:
+    return {n: _page_preloads(arc, n) for n in arc.files if _is_html(arc.mimes.get(n))}
+
+def _member_preloads(arc: SiteArchive, name: str, mime: str | None) -> tuple[str, ...]:
+    links = arc.preloads.get(name)
+    if links is None:
+        links = arc.preloads[name] = _page_preloads(arc, name) if _is_html(mime) else ()
+    return links
+
+def _send_early_hints(request: Request, links: tuple[str, ...]) -> None:
+    # Only servers that advertise the ASGI early-hint extension can send a 103.
+    if "http.response.early_hint" not in request.scope.get("extensions", {}):
+        return
+    try:
+        from_thread.run(request.send_early_hints, *links)
+    except RuntimeError:
+        pass   # not on a threadpool worker (direct call); the Link header still carries them
+
+# ==============================
+# DEFLATE passthrough (zip member → gzip body)
+# ==============================
+
+_LOCAL_HEADER = struct.Struct("<4s5H3I2H")   # zip local file header, 30 bytes
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"  # deflate, no flags, mtime 0, OS unknown
+
+def _accepts_gzip(accept_encoding: str | None) -> bool:
+    if not accept_encoding:
+        return False
+    qualities = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[token.strip().lower()] = q
+    for token in ("gzip", "x-gzip"):
+        if token in qualities:
+            return qualities[token] > 0
+    return qualities.get("*", 0) > 0
+
+def _member_data_offset(arc: SiteArchive, info: zipfile.ZipInfo) -> int:
+    # Central directory sizes are authoritative, but the local header's name/extra
+    # lengths may differ from the central copy, so read them from the local header.
+    off = arc.data_offsets.get(info.filename)
+    if off is None:
+        fields = _LOCAL_HEADER.unpack(arc.src.read_at(info.header_offset, _LOCAL_HEADER.size))
+        if fields[0] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"bad local header for {info.filename}")
+        off = info.header_offset + _LOCAL_HEADER.size + fields[9] + fields[10]
+        arc.data_offsets[info.filename] = off
+    return off
+
+def _can_passthrough(info: zipfile.ZipInfo) -> bool:
+    return info.compress_type == zipfile.ZIP_DEFLATED and not (info.flag_bits & 0x1)
+
+def _gzip_member(arc: SiteArchive, info: zipfile.ZipInfo) -> bytes:
+    # A raw DEFLATE stream is a valid gzip body once wrapped in a 10-byte header
+    # and a CRC32/ISIZE trailer — both already known from the central directory.
+    start = _member_data_offset(arc, info)
+    raw = arc.src.read_at(start, info.compress_size)
+    trailer = struct.pack("<II", info.CRC, info.file_size & 0xFFFFFFFF)
+    return b"".join((_GZIP_HEADER, raw, trailer))
+
+# ==============================
+# Validators & conditional requests
+# ==============================
+
+# Cache-Control per member: --cache-policy globs first (in order), then fingerprinted
+# names (content hash in the file name, e.g. app.3f9a1c2e7b.js) are immutable, then HTML
+# and everything else get the short default.
+CACHE_POLICIES: list[tuple[str, str]] = []
+DEFAULT_CACHE_CONTROL = "public, max-age=60"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# For archives that do not list their renamed members: the name.<hash>.ext publish.py
+# writes (FINGERPRINT_HEX there), with at least one letter so timestamps do not count.
+_FINGERPRINT_RE = re.compile(r"\.(?=[0-9]*[a-f])[0-9a-f]{10}\.[A-Za-z0-9]+$")
+
+def recorded_fingerprints(doc) -> frozenset[str] | None:
+    # publish.py --fingerprint lists the members it renamed in the archive comment (bytes)
+    # or, for --incremental, in the site index (dict).
+    if isinstance(doc, bytes):
+        try:
+            doc = json.loads(doc)
+        except ValueError:
+            return None
+    names = doc.get("fingerprinted") if isinstance(doc, dict) else None
+    return frozenset(n for n in names if isinstance(n, str)) if isinstance(names, list) else None
+
+def is_fingerprinted(name: str, recorded: frozenset[str] | None = None) -> bool:
+    # Pages keep their URLs across publishes, so HTML is never treated as immutable.
+    if name.endswith((".html", ".htm")):
+        return False
+    if recorded is not None:
+        return name in recorded
+    return bool(_FINGERPRINT_RE.search(posixpath.basename(name)))
+
+def _member_cache_control(arc: SiteArchive, name: str) -> str:
+    value = arc.cache_controls.get(name)
+    if value is None:
+        value = next((v for pattern, v in CACHE_POLICIES if fnmatch.fnmatchcase(name, pattern)), None)
+        if value is None:
+            value = IMMUTABLE_CACHE_CONTROL if is_fingerprinted(name, arc.fingerprinted) else DEFAULT_CACHE_CONTROL
+        arc.cache_controls[name] = value
+    return value
+
+def _member_etag(info: zipfile.ZipInfo, *, gzip: bool = False) -> str:
+    # CRC32 + size from the central directory identify the content; the gzip
+    # representation is a different byte sequence, so it gets its own strong tag.
+    return '"%08x-%x%s"' % (info.CRC, info.file_size, "-gz" if gzip else "")
+
+def _member_last_modified(info: zipfile.ZipInfo) -> datetime | None:
+    # Zip timestamps carry no zone; treat them as UTC and never report the future.
+    # Reproducible archives stamp every member with the zip epoch, which dates nothing;
+    # those members are validated by ETag alone.
+    if tuple(info.date_time) == (1980, 1, 1, 0, 0, 0):
+        return None
     try:
-        data = ZIP.read(name)
+        dt = datetime(*info.date_time, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return min(dt, datetime.now(timezone.utc))
+
+def _etag_opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def _not_modified(request: Request | None, info: zipfile.ZipInfo, last_modified: datetime | None) -> bool:
+    if request is None:
+        return False
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        # Weak comparison (RFC 9110 §13.1.2); either representation of this member matches.
+        if inm.strip() == "*":
+            return True
+        current = {_member_etag(info), _member_etag(info, gzip=True)}
+        return any(_etag_opaque(t) in current for t in inm.split(","))
+    ims = request.headers.get("if-modified-since")
+    if ims and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+# ==============================
+# Range requests & streaming
+# ==============================
+
+SEEK_SPAN = 4 << 20          # inflated bytes between DEFLATE seek points
+SEEK_INDEX_MEMBERS = 32      # members whose seek points are kept (each point ≈ 40 KiB)
+
+class _SeekIndex:
+    """
+    Per-member DEFLATE checkpoints (out_offset, in_offset, decompressor snapshot),
+    keyed by (archive key, member name) and recorded while a member is being
+    inflated, so later ranges resume from the nearest checkpoint instead of
+    inflating from byte 0.
+    """
+
+    def __init__(self, max_members: int):
+        self.max_members = max_members
+        self._lock = threading.Lock()
+        self._points: OrderedDict[tuple[str, str], list] = OrderedDict()
+
+    def nearest(self, key: tuple[str, str], offset: int):
+        with self._lock:
+            points = self._points.get(key)
+            if not points:
+                return None
+            self._points.move_to_end(key)
+            best = None
+            for p in points:
+                if p[0] > offset:
+                    break
+                best = p
+            return best
+
+    def last_out(self, key: tuple[str, str]) -> int:
+        with self._lock:
+            points = self._points.get(key)
+            return points[-1][0] if points else 0
+
+    def add(self, key: tuple[str, str], out_off: int, in_off: int, snapshot) -> None:
+        with self._lock:
+            points = self._points.setdefault(key, [])
+            self._points.move_to_end(key)
+            if points and points[-1][0] >= out_off:
+                return
+            points.append((out_off, in_off, snapshot))
+            while len(self._points) > self.max_members:
+                self._points.popitem(last=False)
+
+    def discard(self, archive_key: str) -> None:
+        with self._lock:
+            for key in [k for k in self._points if k[0] == archive_key]:
+                del self._points[key]
+
+SEEK_INDEX = _SeekIndex(SEEK_INDEX_MEMBERS)
+
+def _parse_range(value: str | None, size: int):
+    """Returns (start, end_exclusive), None for no/ignored range, or "unsatisfiable"."""
+    if not value or not value.startswith("bytes="):
+        return None
+    spec = value[6:].strip()
+    if "," in spec:
+        return None                      # multipart ranges: serve the full body instead
+    first, sep, last = spec.partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            n = int(last)
+            if n <= 0:
+                return "unsatisfiable"
+            return (max(0, size - n), size)
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start < 0 or end <= start:
+        return None if end <= start and last else "unsatisfiable"
+    if start >= size:
+        return "unsatisfiable"
+    return (start, min(end, size))
+
+def _if_range_matches(request: Request, info: zipfile.ZipInfo, last_modified: datetime | None) -> bool:
+    value = request.headers.get("if-range")
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith(("W/", '"')):
+        return value == _member_etag(info)   # strong comparison; weak tags never match
+    if last_modified is None:
+        return False
+    try:
+        return parsedate_to_datetime(value) == last_modified.replace(microsecond=0)
+    except (TypeError, ValueError):
+        return False
+
+def _iter_stored(src, start: int, end: int):
+    for off in range(start, end, CHUNK_SIZE):
+        yield bytes(src.read_at(off, min(CHUNK_SIZE, end - off)))
+
+def _iter_inflated(arc: SiteArchive, info: zipfile.ZipInfo, start: int, end: int):
+    src = arc.src
+    base = _member_data_offset(arc, info)
+    comp_end = info.compress_size
+    key = (arc.etag, info.filename)
+    point = SEEK_INDEX.nearest(key, start)
+    if point:
+        out_pos, in_pos, snap = point
+        d = snap.copy()
+    else:
+        out_pos, in_pos, d = 0, 0, zlib.decompressobj(-zlib.MAX_WBITS)
+    next_mark = max(out_pos, SEEK_INDEX.last_out(key)) + SEEK_SPAN
+    pending = b""
+    first_out, spent = out_pos, 0.0
+    try:
+        while out_pos < end and not d.eof:
+            if not pending and in_pos < comp_end:
+                pending = src.read_at(base + in_pos, min(CHUNK_SIZE, comp_end - in_pos))
+            fed = len(pending)
+            t0 = time.perf_counter()
+            out = d.decompress(pending, CHUNK_SIZE)
+            spent += time.perf_counter() - t0
+            pending = d.unconsumed_tail
+            in_pos += fed - len(pending)
+            if not out:
+                if in_pos >= comp_end and not pending:
+                    break                            # truncated stream; nothing more to emit
+                continue
+            lo, hi = out_pos, out_pos + len(out)
+            out_pos = hi
+            if hi > start:
+                yield out[max(0, start - lo):min(len(out), end - lo)]
+            if out_pos >= next_mark:
+                SEEK_INDEX.add(key, out_pos, in_pos, d.copy())
+                next_mark = out_pos + SEEK_SPAN
+    finally:
+        METRICS.observe_inflate(spent, out_pos - first_out)
+
+def _iter_gzip(arc: SiteArchive, info: zipfile.ZipInfo):
+    start = _member_data_offset(arc, info)
+    yield _GZIP_HEADER
+    yield from _iter_stored(arc.src, start, start + info.compress_size)
+    yield struct.pack("<II", info.CRC, info.file_size & 0xFFFFFFFF)
+
+def _iter_zipext(zf: zipfile.ZipFile, name: str, start: int, end: int):
+    # Fallback for compression methods we do not index (bzip2, lzma).
+    with zf.open(name) as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _iter_member(arc: SiteArchive, info: zipfile.ZipInfo, start: int, end: int):
+    # A generator frame holds `arc`, so a stream finishes against the archive it
+    # started on even if a hot swap replaces the site's archive mid-response.
+    if info.flag_bits & 0x1:
+        yield from _iter_zipext(arc.zf, info.filename, start, end)
+    elif info.compress_type == zipfile.ZIP_STORED:
+        base = _member_data_offset(arc, info)
+        yield from _iter_stored(arc.src, base + start, base + end)
+    elif info.compress_type == zipfile.ZIP_DEFLATED:
+        yield from _iter_inflated(arc, info, start, end)
+    else:
+        yield from _iter_zipext(arc.zf, info.filename, start, end)
+
+def _serve_member(arc: SiteArchive, name: str, request: Request | None = None):
+    try:
+        info = arc.zf.getinfo(name)
     except KeyError:
         raise HTTPException(404, "Not in archive")
+    size = info.file_size
+    last_modified = _member_last_modified(info)
+    rng = None
+    if request is not None and _if_range_matches(request, info, last_modified):
+        rng = _parse_range(request.headers.get("range"), size)
+    accept = request.headers.get("accept-encoding") if request is not None else None
+    gzip = rng is None and _can_passthrough(info) and _accepts_gzip(accept)
+    mime = arc.mimes.get(name) or _member_mime(arc, name)
     headers = {
-        "ETag": ETAG,
-        "Cache-Control": "public, max-age=60",
-        "Last-Modified": STARTED_AT,
+        "ETag": _member_etag(info, gzip=gzip),
+        "Cache-Control": _member_cache_control(arc, name),
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
         "X-From": "zip-gateway",
     }
-    return Response(data, media_type=_guess_mime(name), headers=headers)
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if _not_modified(request, info, last_modified):
+        return Response(status_code=304, headers=headers)
+    links = _member_preloads(arc, name, mime)
+    if links and rng is None:
+        headers["Link"] = ", ".join(links)
+        if EARLY_HINTS and request is not None:
+            _send_early_hints(request, links)
+
+    if rng == "unsatisfiable":
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if rng is not None:
+        start, end = rng
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        if size <= STREAM_THRESHOLD:
+            return Response(_read_member(arc, name)[start:end], status_code=206, media_type=mime, headers=headers)
+        headers["Content-Length"] = str(end - start)
+        return StreamingResponse(_iter_member(arc, info, start, end), status_code=206, media_type=mime, headers=headers)
+
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+        if info.compress_size <= STREAM_THRESHOLD:
+            return Response(_gzip_member(arc, info), media_type=mime, headers=headers)
+        headers["Content-Length"] = str(len(_GZIP_HEADER) + info.compress_size + 8)
+        return StreamingResponse(_iter_gzip(arc, info), media_type=mime, headers=headers)
+    if size > STREAM_THRESHOLD:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_member(arc, info, 0, size), media_type=mime, headers=headers)
+    data = _read_member(arc, name)
+    return Response(data, media_type=mime, headers=headers)
+
+async def _handle_size(handle) -> int | None:
+    for sname in ("size", "len", "length"):
+        if hasattr(handle, sname):
+            try:
+                size = await maybe_await(getattr(handle, sname)())
+            except TypeError:
+                size = getattr(handle, sname)
+            if isinstance(size, int) and size >= 0:
+                return size
+    return None
+
+DOWNLOAD_INFLIGHT = 6         # concurrent range reads per download (and the SDK's max_inflight)
+SEGMENT_SIZE = 8 << 20        # bytes per range read in a segmented download
+DOWNLOAD_RETRIES = 3          # attempts per failed segment, after the first
+INDEX_MAX_BYTES = 64 << 20    # a "{"-headed object up to this size is read whole as a site index
+
+class NotAZipError(RuntimeError):
+    """
+    The object does not start with a zip local header; `head` holds its first bytes
+    and `data` the whole object when it was read anyway (a site index, see _is_index).
+    """
+
+    def __init__(self, head: bytes, data: bytes | None = None):
+        super().__init__("Downloaded bytes are not a ZIP (missing PK header).")
+        self.head = head
+        self.data = data
+
+class DownloadSink:
+    """
+    Destination for a download: one buffer preallocated to the expected size (or a
+    file), written in place as chunks arrive. The SHA-256 and the zip magic check
+    run incrementally on the same pass, so nothing is copied or re-read afterwards.
+    """
+
+    def __init__(self, size: int | None = None, *, path: Path | None = None, expect_zip: bool = False):
+        self.size = size
+        self.path = path
+        self.expect_zip = expect_zip
+        self.pos = 0
+        self._sha = hashlib.sha256()
+        self._head = b""
+        self._file = None
+        self._buf = None
+        self._pending: dict[int, object] = {}
+        if path is not None:
+            self._file = open(path, "wb")
+        elif size is not None:
+            self._buf = bytearray(size)
+        else:
+            self._buf = bytearray()
+
+    def _check_head(self, chunk) -> None:
+        if len(self._head) < 4:
+            self._head += bytes(chunk[:4 - len(self._head)])
+            if len(self._head) >= 4 and self.expect_zip and self._head != b"PK\x03\x04":
+                # A site index is small; finishing it spares the caller a second download.
+                if not (self._head[:1] == b"{" and self.size is not None and self.size <= INDEX_MAX_BYTES):
+                    raise NotAZipError(self._head)
+
+    def write(self, chunk) -> None:
+        n = len(chunk)
+        if not n:
+            return
+        self._check_head(chunk)
+        self._sha.update(chunk)
+        if self._file is not None:
+            self._file.write(chunk)
+        elif self.size is not None and self.pos + n <= len(self._buf):
+            self._buf[self.pos:self.pos + n] = chunk
+        else:
+            # Unknown size, or the handle delivered more than it announced.
+            del self._buf[self.pos:]
+            self._buf += chunk
+        self.pos += n
+
+    def write_at(self, offset: int, chunk) -> None:
+        """
+        Place `chunk` at `offset` (segments may land out of order). The digest and the
+        magic check follow the contiguous prefix; segments ahead of it wait in _pending.
+        """
+        n = len(chunk)
+        if self._file is not None:
+            self._file.seek(offset)
+            self._file.write(chunk)
+            self._pending[offset] = bytes(chunk)
+        else:
+            if self.size is None or offset + n > self.size:
+                raise RuntimeError("write_at needs a buffer preallocated to the full size")
+            self._buf[offset:offset + n] = chunk
+            self._pending[offset] = n
+        while self.pos in self._pending:
+            item = self._pending.pop(self.pos)
+            view = memoryview(self._buf)[self.pos:self.pos + item] if isinstance(item, int) else item
+            self._check_head(view)
+            self._sha.update(view)
+            self.pos += len(view)
+
+    def hexdigest(self) -> str:
+        return self._sha.hexdigest()
+
+    def close(self) -> None:
+        if self._file is not None and not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def finish(self) -> None:
+        self.close()
+        if self.expect_zip and len(self._head) < 4:
+            raise NotAZipError(self._head)
+        # A truncated archive must not reach the cache: its digest would "verify" forever.
+        if self.size is not None and self.pos != self.size:
+            raise IOError(f"download ended at {self.pos} of {self.size} bytes")
+        if self.expect_zip and self._head != b"PK\x03\x04":
+            data = self.path.read_bytes() if self._buf is None else bytes(self.getbuffer())
+            raise NotAZipError(self._head, data)
+
+    def getbuffer(self):
+        """The downloaded bytes without copying (a memoryview when shorter than announced)."""
+        if self._buf is None:
+            raise RuntimeError("download was written to a file")
+        return self._buf if self.pos == len(self._buf) else memoryview(self._buf)[:self.pos]
 
-async def read_handle_bytes(handle, *, chunk_size: int = 1 << 20) -> bytes:
+async def read_handle_into(handle, sink: DownloadSink, *, chunk_size: int = 1 << 20) -> DownloadSink:
     # 1) Common "read all" shapes
     for rname in ("read_all", "read_to_end", "bytes"):
         if hasattr(handle, rname):
-            return bytes(await maybe_await(getattr(handle, rname)()))
+            sink.write(await maybe_await(getattr(handle, rname)()))
+            return sink
 
     # 2) Pull-based chunk readers
     for rname in ("read", "next_chunk"):
         if hasattr(handle, rname):
-            out = bytearray()
             reader = getattr(handle, rname)
             while True:
                 chunk = await maybe_await(reader())
                 if not chunk:
                     break
-                out.extend(chunk)
-            return bytes(out)
+                sink.write(chunk)
+            return sink
 
     # 2b) indexd_ffi.Download shape: read_chunk()
     if hasattr(handle, "read_chunk"):
-        out = bytearray()
         while True:
             chunk = await maybe_await(handle.read_chunk())
             if not chunk:
                 break
-            out.extend(chunk)
-        return bytes(out)
+            sink.write(chunk)
+        return sink
 
     # 3) Range reader (size + read_at)
-    size = None
-    for sname in ("size", "len", "length"):
-        if hasattr(handle, sname):
-            try:
-                size = await maybe_await(getattr(handle, sname)())
-            except TypeError:
-                size = getattr(handle, sname)
-            if isinstance(size, int) and size >= 0:
-                break
-            size = None
+    size = await _handle_size(handle)
+    if size is not None and hasattr(handle, "read_at") and sink.size == size and sink.pos == 0:
+        await download_segments(handle.read_at, size, sink)
+        return sink
     if size is not None and hasattr(handle, "read_at"):
-        out = bytearray()
         off = 0
         while off < size:
             n = min(chunk_size, size - off)
             chunk = await maybe_await(handle.read_at(off, n))
             if not chunk:
                 break
-            out.extend(chunk)
+            sink.write(chunk)
             off += len(chunk)
-        return bytes(out)
+        return sink
 
     # 4) Streams (async iterator or .stream() → object with .read())
     if hasattr(handle, "__aiter__"):
-        out = bytearray()
         async for chunk in handle:  # type: ignore
             if not chunk:
                 break
-            out.extend(chunk)
-        return bytes(out)
+            sink.write(chunk)
+        return sink
     if hasattr(handle, "stream"):
         s = await maybe_await(handle.stream())
         if hasattr(s, "read"):
-            out = bytearray()
             while True:
                 chunk = await maybe_await(s.read(chunk_size))
                 if not chunk:
                     break
-                out.extend(chunk)
-            return bytes(out)
+                sink.write(chunk)
+            return sink
         if hasattr(s, "__aiter__"):
-            out = bytearray()
             async for chunk in s:  # type: ignore
                 if not chunk:
                     break
-                out.extend(chunk)
-            return bytes(out)
+                sink.write(chunk)
+            return sink
 
     # 5) .open() → filelike with read()
     if hasattr(handle, "open"):
         f = await maybe_await(handle.open())
         if hasattr(f, "read"):
-            out = bytearray()
             while True:
                 chunk = await maybe_await(f.read(chunk_size))
                 if not chunk:
                     break
-                out.extend(chunk)
-            return bytes(out)
+                sink.write(chunk)
+            return sink
 
     # 6) __bytes__ or direct bytes()
     if hasattr(handle, "__bytes__"):
         try:
-            return bytes(handle)
+            sink.write(bytes(handle))
+            return sink
+        except RuntimeError:
+            raise
         except Exception:
             pass
 
@@ -298,8 +1503,9 @@ async def read_handle_bytes(handle, *, chunk_size: int = 1 << 20) -> bytes:
     for attr in ("content", "data", "body"):
         if hasattr(handle, attr):
             b = getattr(handle, attr)
-            if isinstance(b, (bytes, bytearray)):
-                return bytes(b)
+            if isinstance(b, (bytes, bytearray, memoryview)):
+                sink.write(b)
+                return sink
 
     # 8) Helpful error
     t = type(handle)
@@ -310,18 +1516,29 @@ async def read_handle_bytes(handle, *, chunk_size: int = 1 << 20) -> bytes:
         f"attrs={attrs}"
     )
 
+async def read_handle_bytes(handle, *, chunk_size: int = 1 << 20):
+    """All of a handle's bytes, in one buffer preallocated when the handle reports its size."""
+    sink = DownloadSink(await _handle_size(handle))
+    await read_handle_into(handle, sink, chunk_size=chunk_size)
+    sink.finish()
+    return sink.getbuffer()
+
 # ==============================
 # SDK download (resolve → download_shared)
 # ==============================
 
-async def fetch_zip_via_sdk(share_url: str, indexd_base: str | None, *, no_auth: bool, env_path: str, auth_fallback: bool) -> bytes:
-    # Windows event loop policy (helps some async stacks)
-    if sys.platform.startswith("win"):
-        try:
-            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-        except Exception:
-            pass
+_SDKS: dict[tuple[str, str], "Sdk"] = {}   # (indexd base, "anon" | "auth") → Sdk shared by every site
+_SDKS_LOCK = threading.Lock()
+
+def _shared_sdk(indexd_base: str, kind: str, make) -> "Sdk":
+    with _SDKS_LOCK:
+        sdk = _SDKS.get((indexd_base, kind))
+        if sdk is None:
+            sdk = _SDKS[(indexd_base, kind)] = make()
+        return sdk
 
+async def _with_shared_object(share_url: str, indexd_base: str | None, action, *, no_auth: bool, env_path: str, auth_fallback: bool):
+    """Resolve the share (no-auth first, optional interactive auth fallback) and run `await action(sdk, ref)`."""
     if not indexd_base:
         indexd_base = _extract_indexd_base(share_url)
 
@@ -329,17 +1546,14 @@ async def fetch_zip_via_sdk(share_url: str, indexd_base: str | None, *, no_auth:
 
     # Prefer "no-auth" path: ephemeral key, do NOT request approval.
     if no_auth:
-        ephemeral_mnemonic = generate_recovery_phrase()
-        ephemeral_app_id = secrets.token_bytes(32)
-        sdk = Sdk(indexd_base, AppKey(ephemeral_mnemonic, ephemeral_app_id))
+        sdk = _shared_sdk(indexd_base, "anon", lambda: Sdk(
+            indexd_base, AppKey(generate_recovery_phrase(), secrets.token_bytes(32))))
         try:
             # Directly try the shared-object flow without checking sdk.connected()
             ref = await maybe_await(sdk.shared_object(share_url))
-            handle = await maybe_await(sdk.download_shared(ref, DownloadOptions(max_inflight=6)))
-            data = await read_handle_bytes(handle)
-            if not data.startswith(b"PK\x03\x04"):
-                raise RuntimeError("Downloaded bytes are not a ZIP (missing PK header).")
-            return data
+            return await action(sdk, ref)
+        except NotAZipError:
+            raise   # the object was readable; authenticating would not change its bytes
         except Exception as e:
             if not auth_fallback:
                 raise
@@ -347,8 +1561,7 @@ async def fetch_zip_via_sdk(share_url: str, indexd_base: str | None, *, no_auth:
             # fall-through to auth path below
 
     # Auth path: ensure connection approved, then download
-    seed_phrase, app_id = _load_or_prompt_env(env_path)
-    sdk = Sdk(indexd_base, AppKey(seed_phrase, app_id))
+    sdk = _shared_sdk(indexd_base, "auth", lambda: Sdk(indexd_base, AppKey(*_load_or_prompt_env(env_path))))
     is_connected = await maybe_await(sdk.connected()) if hasattr(sdk, "connected") else True
     if not is_connected:
         resp = await maybe_await(sdk.request_app_connection(AppMeta(
@@ -369,20 +1582,979 @@ async def fetch_zip_via_sdk(share_url: str, indexd_base: str | None, *, no_auth:
             raise RuntimeError("Authorization was not granted")
 
     ref = await maybe_await(sdk.shared_object(share_url))
-    handle = await maybe_await(sdk.download_shared(ref, DownloadOptions(max_inflight=6)))
-    data = await read_handle_bytes(handle)
-    if not data.startswith(b"PK\x03\x04"):
-        raise RuntimeError("Downloaded bytes are not a ZIP (missing PK header).")
-    return data
+    return await action(sdk, ref)
+
+def _range_reader(sdk, ref, handle):
+    """async read_range(offset, n) for a shared object, or None if this SDK build cannot read ranges."""
+    if hasattr(handle, "read_at"):
+        async def read_range(offset: int, n: int) -> bytes:
+            return await maybe_await(handle.read_at(offset, n))
+        return read_range
+    try:
+        DownloadOptions(max_inflight=DOWNLOAD_INFLIGHT, offset=0, length=1)
+    except TypeError:
+        return None
+
+    async def read_range(offset: int, n: int) -> bytes:
+        h = await maybe_await(sdk.download_shared(ref, DownloadOptions(max_inflight=DOWNLOAD_INFLIGHT,
+                                                                       offset=offset, length=n)))
+        return await read_handle_bytes(h)
+    return read_range
+
+async def download_segments(read_range, size: int, sink: DownloadSink, *, segment_size: int | None = None,
+                            inflight: int | None = None, retries: int = DOWNLOAD_RETRIES) -> DownloadSink:
+    """
+    Fetch [0, size) as fixed-size segments with up to `inflight` range reads in flight,
+    writing each into the sink at its offset. A failed segment is retried on its own,
+    resuming from the last byte it delivered. Workers stay within a window of the
+    sink's contiguous prefix so out-of-order segments held for hashing stay bounded.
+    """
+    segment_size = max(1, segment_size or SEGMENT_SIZE)
+    inflight = max(1, inflight or DOWNLOAD_INFLIGHT)
+    count = -(-size // segment_size)
+    window = max(4, 2 * inflight) * segment_size
+    progressed = asyncio.Event()
+    next_index = 0
+
+    async def fetch(i: int) -> None:
+        off, end = i * segment_size, min(size, (i + 1) * segment_size)
+        for attempt in range(retries + 1):
+            try:
+                while off < end:
+                    chunk = await maybe_await(read_range(off, end - off))
+                    if not chunk:
+                        raise RuntimeError(f"empty read at offset {off}")
+                    chunk = chunk[:end - off]
+                    sink.write_at(off, chunk)
+                    off += len(chunk)
+                return
+            except Exception as e:
+                if attempt == retries:
+                    raise RuntimeError(f"segment {i} (bytes {off}-{end - 1}) failed after "
+                                       f"{retries + 1} attempts: {e}") from e
+                print(f"WARN: segment {i} (bytes {off}-{end - 1}) failed: {e}; retry {attempt + 1}/{retries}")
+                await asyncio.sleep(min(8.0, 0.5 * 2 ** attempt))
+
+    async def worker() -> None:
+        nonlocal next_index
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            while i * segment_size >= sink.pos + window:
+                progressed.clear()
+                await progressed.wait()
+            await fetch(i)
+            progressed.set()
+
+    tasks = [asyncio.ensure_future(worker()) for _ in range(min(inflight, count))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    return sink
+
+async def fetch_zip_via_sdk(share_url: str, indexd_base: str | None, *, no_auth: bool, env_path: str,
+                            auth_fallback: bool, path: Path | None = None, expect_zip: bool = True,
+                            site_name: str = "-") -> DownloadSink:
+    """
+    Download the shared zip into a preallocated buffer, or straight into `path` when
+    given. The returned sink carries the SHA-256 computed while the bytes arrived.
+    Raises NotAZipError as soon as the first bytes show something else (unless
+    expect_zip is False, as for site indexes). Timings are reported under site_name.
+    """
+    async def download(sdk, ref) -> DownloadSink:
+        t0 = time.perf_counter()
+        handle = await maybe_await(sdk.download_shared(ref, DownloadOptions(max_inflight=DOWNLOAD_INFLIGHT)))
+        size = await _handle_size(handle)
+        if size is None:
+            size = await _handle_size(ref)
+        sink = DownloadSink(size, path=path, expect_zip=expect_zip)
+        # Objects larger than one segment are fetched as parallel ranges when the SDK can.
+        read_range = _range_reader(sdk, ref, handle) if size and size > SEGMENT_SIZE else None
+        try:
+            if read_range is not None:
+                await download_segments(read_range, size, sink)
+            else:
+                await read_handle_into(handle, sink)
+        finally:
+            sink.close()
+        try:
+            sink.finish()
+        except NotAZipError as e:
+            if e.data is not None:    # a site index, read whole
+                METRICS.observe_download(f"{site_name}#index", time.perf_counter() - t0, sink.pos)
+            raise
+        METRICS.observe_download(site_name, time.perf_counter() - t0, sink.pos)
+        return sink
+
+    return await _with_shared_object(share_url, indexd_base, download,
+                                     no_auth=no_auth, env_path=env_path, auth_fallback=auth_fallback)
+
+# ==============================
+# Archive sources (in-memory or lazily fetched ranges)
+# ==============================
+
+class BufferSource:
+    """Archive already held in a buffer (bytes, bytearray, mmap)."""
+
+    resident = True
+
+    def __init__(self, buf):
+        self._mv = memoryview(buf)
+        self.size = len(self._mv)
+
+    def read_at(self, offset: int, n: int):
+        return self._mv[offset:offset + n]
+
+class MappedSource(BufferSource):
+    """Archive file mapped read-only; the OS page cache holds the bytes, not the Python heap."""
+
+    resident = False
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        super().__init__(self._mmap)
+
+class RemoteSource:
+    """
+    Archive fetched on demand in fixed-size blocks via an async `read_range(offset, n)`,
+    run on the SDK loop thread. Fetched blocks are written to a local sparse file and
+    tracked in a one-byte-per-block sidecar, so a restart reuses what was already pulled.
+    """
+
+    resident = False
+
+    def __init__(self, size: int, read_range, runner, cache_path: Path, *, block_size: int = 1 << 20):
+        self.size = size
+        self.block_size = block_size
+        self.path = cache_path
+        self._read_range = read_range
+        self._run = runner
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._inflight: dict[int, threading.Event] = {}
+        nblocks = (size + block_size - 1) // block_size
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        map_path = Path(str(cache_path) + ".blocks")
+        for p in (cache_path, map_path):
+            if not p.exists():
+                p.touch(mode=0o600)
+        self._file = open(cache_path, "r+b")
+        self._file.truncate(size)
+        os.utime(cache_path)   # recency for prune_archive_cache
+        self._map = open(map_path, "r+b")
+        flags = self._map.read(nblocks).ljust(nblocks, b"\x00")
+        self._have = {i for i, f in enumerate(flags) if f}
+        self.fetched_bytes = 0
+        if self._have:
+            print(f"Lazy cache: reusing {len(self._have)}/{nblocks} blocks from {cache_path}")
+
+    def _fetch(self, first: int, last: int) -> None:
+        off = first * self.block_size
+        end = min(self.size, (last + 1) * self.block_size)
+        pos = off
+        while pos < end:
+            chunk = self._run(self._read_range(pos, end - pos))
+            if not chunk:
+                raise IOError(f"short read at offset {pos} (wanted {end - pos} bytes)")
+            with self._io_lock:
+                self._file.seek(pos)
+                self._file.write(chunk)
+            pos += len(chunk)
+        with self._io_lock:
+            self._file.flush()
+            self._map.seek(first)
+            self._map.write(b"\x01" * (last - first + 1))
+            self._map.flush()
+        with self._lock:
+            self._have.update(range(first, last + 1))
+            self.fetched_bytes += end - off
+
+    def _ensure(self, first: int, last: int) -> None:
+        b = first
+        while b <= last:
+            with self._lock:
+                if b in self._have:
+                    b += 1
+                    continue
+                ev = self._inflight.get(b)
+                run_end = b
+                if ev is None:
+                    # Claim the contiguous run of missing blocks so it is fetched in one call.
+                    while run_end + 1 <= last and run_end + 1 not in self._have and run_end + 1 not in self._inflight:
+                        run_end += 1
+                    ev = threading.Event()
+                    for i in range(b, run_end + 1):
+                        self._inflight[i] = ev
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                ev.wait()      # retried on the next pass if the owner failed
+                continue
+            try:
+                self._fetch(b, run_end)
+            finally:
+                with self._lock:
+                    for i in range(b, run_end + 1):
+                        self._inflight.pop(i, None)
+                ev.set()
+            b = run_end + 1
+
+    def read_at(self, offset: int, n: int) -> bytes:
+        n = max(0, min(n, self.size - offset))
+        if n == 0:
+            return b""
+        self._ensure(offset // self.block_size, (offset + n - 1) // self.block_size)
+        with self._io_lock:
+            self._file.seek(offset)
+            return self._file.read(n)
+
+class ConcatSource:
+    """Several sources read as one, end to end (the packs of an incremental site)."""
+
+    resident = False
+
+    def __init__(self, parts):
+        self.parts = list(parts)
+        self._starts = []
+        self.size = 0
+        for part in self.parts:
+            self._starts.append(self.size)
+            self.size += part.size
+        self.resident_bytes = sum(p.size for p in self.parts if p.resident)
+
+    def read_at(self, offset: int, n: int):
+        end = min(self.size, offset + n)
+        i = bisect.bisect_right(self._starts, offset) - 1
+        out = []
+        while offset < end:
+            part, start = self.parts[i], self._starts[i]
+            take = min(end, start + part.size) - offset
+            if take > 0:
+                out.append(part.read_at(offset - start, take))
+                offset += take
+            i += 1
+        # Reads inside one part (every member read) keep that part's zero-copy view.
+        return out[0] if len(out) == 1 else b"".join(out)
+
+def _source_is_local(src) -> bool:
+    # True when member bytes can be read at load time without network round trips.
+    return all(isinstance(p, BufferSource) for p in getattr(src, "parts", (src,)))
+
+class _SourceFile(io.RawIOBase):
+    """Seekable read-only file over an archive source, so zipfile can read it."""
+
+    def __init__(self, src):
+        self._src = src
+        self._pos = 0
+
+    def readable(self): return True
+    def seekable(self): return True
+    def tell(self): return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._src.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self._src.size - self._pos
+        data = bytes(self._src.read_at(self._pos, n))
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+class _LoopThread:
+    """Dedicated event loop for SDK calls made from synchronous request handlers."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="sdk-loop", daemon=True).start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+def _share_object_id(share_url: str) -> str:
+    # Share URLs look like <indexd>/objects/<id>/shared?...; fall back to a hash of the URL.
+    parts = [p for p in urlparse(share_url).path.split("/") if p]
+    if "objects" in parts and parts.index("objects") + 1 < len(parts):
+        return parts[parts.index("objects") + 1]
+    return hashlib.sha256(share_url.split("#", 1)[0].encode("utf-8")).hexdigest()
+
+async def _make_range_reader(sdk, ref):
+    """Returns (size, async read_range(offset, n)) for a shared object, or raises if unsupported."""
+    handle = await maybe_await(sdk.download_shared(ref, DownloadOptions(max_inflight=DOWNLOAD_INFLIGHT)))
+    size = await _handle_size(handle)
+    if size is None:
+        size = await _handle_size(ref)
+    if size is None:
+        raise RuntimeError("Cannot determine the shared object's size; lazy mode needs it.")
+    read_range = _range_reader(sdk, ref, handle)
+    if read_range is None:
+        raise RuntimeError("Download handle has no read_at() and DownloadOptions has no offset/length; "
+                           "lazy mode is not supported by this SDK build.")
+    return size, read_range
+
+def open_remote_source(share_url: str, indexd_base: str | None, runner: _LoopThread, cache_dir: Path, *,
+                       block_size: int, no_auth: bool, env_path: str, auth_fallback: bool) -> RemoteSource:
+    size, read_range = runner.run(_with_shared_object(
+        share_url, indexd_base, _make_range_reader,
+        no_auth=no_auth, env_path=env_path, auth_fallback=auth_fallback))
+    cache_path = cache_dir / f"{_share_object_id(share_url)}-{block_size >> 10}k.part"
+    return RemoteSource(size, read_range, runner.run, cache_path, block_size=block_size)
+
+def archive_from_bytes(data, digest: str | None = None) -> SiteArchive:
+    # zipfile reads through _SourceFile, so the buffer is never copied into a BytesIO.
+    src = BufferSource(data)
+    digest = digest or hashlib.sha256(data).hexdigest()
+    return SiteArchive(zipfile.ZipFile(_SourceFile(src), "r"), src, 'W/"%s"' % digest[:32])
+
+def archive_from_source(src) -> SiteArchive:
+    # Only the end-of-central-directory record and the central directory are read
+    # here; member bytes are pulled from the source on first request.
+    zf = zipfile.ZipFile(_SourceFile(src), "r")
+    cd = bytes(src.read_at(zf.start_dir, src.size - zf.start_dir))
+    return SiteArchive(zf, src, 'W/"%s"' % hashlib.sha256(cd).hexdigest()[:32])
+
+def archive_from_file(path: Path, digest: str) -> SiteArchive:
+    if path.suffix == ".json":
+        # A resolved site index (see resolve_index_file): its packs are cached archives too.
+        resolved = json.loads(path.read_text(encoding="utf-8"))
+        return archive_from_index(resolved["index"], [MappedSource(Path(p)) for p in resolved["packs"]])
+    src = MappedSource(path)
+    return SiteArchive(zipfile.ZipFile(_SourceFile(src), "r"), src, 'W/"%s"' % digest[:32])
+
+# ==============================
+# Persistent archive cache (content-addressed, mmap-backed)
+# ==============================
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _archive_cache_paths(cache_dir: Path, share_url: str) -> tuple[Path, Path]:
+    key = _share_object_id(share_url)
+    return cache_dir / f"{key}.zip", cache_dir / f"{key}.sha256"
+
+def cached_archive_file(cache_dir: Path, share_url: str) -> tuple[Path, str] | None:
+    """(path, sha256) of a previously downloaded archive, if present and still matching its digest."""
+    path, digest_path = _archive_cache_paths(cache_dir, share_url)
+    if not (path.exists() and digest_path.exists()):
+        return None
+    expected = digest_path.read_text(encoding="utf-8").strip()
+    actual = _file_sha256(path)
+    if actual != expected:
+        print(f"WARN: cached archive {path} failed verification; re-downloading.")
+        for p in (path, digest_path):
+            p.unlink(missing_ok=True)
+        return None
+    os.utime(path)   # recency for prune_archive_cache
+    return path, actual
+
+def open_cached_archive(cache_dir: Path, share_url: str) -> SiteArchive | None:
+    """Map a previously downloaded archive if present and its SHA-256 still matches."""
+    found = cached_archive_file(cache_dir, share_url)
+    return archive_from_file(*found) if found else None
+
+def download_to_cache(cache_dir: Path, site: Site, runner: _LoopThread, args) -> tuple[Path, str]:
+    """
+    Stream the archive straight into the cache directory (temp file + rename, then the
+    digest sidecar); returns (path, sha256). The bytes never sit on the Python heap.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path, digest_path = _archive_cache_paths(cache_dir, site.share_url)
+    tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    try:
+        sink = runner.run(fetch_zip_via_sdk(
+            site.share_url,
+            site.indexd,
+            no_auth=args.no_auth,
+            env_path=args.env,
+            auth_fallback=args.auth_fallback,
+            path=tmp,
+            site_name=site.name
+        ))
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    digest = sink.hexdigest()
+    _write_text_atomic(digest_path, digest)
+    return path, digest
+
+def _source_paths(src) -> set[Path]:
+    if isinstance(src, ConcatSource):
+        return set().union(*(_source_paths(p) for p in src.parts))
+    return {src.path} if isinstance(src, (MappedSource, RemoteSource)) else set()
+
+def _disk_bytes(path: Path) -> int:
+    # Lazy .part files are sparse: count the blocks actually written, not the archive size.
+    st = path.stat()
+    return st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+
+def prune_archive_cache(cache_dir: Path, budget_bytes: int, keep=(), replacing: str | None = None) -> None:
+    """
+    Delete the least recently used archives (and resolved indexes, or lazily fetched
+    .part files) until the directory fits budget_bytes. `keep` and archives a loaded
+    site still uses are never deleted, except the one of site `replacing`, which a hot
+    swap is about to supersede. budget_bytes <= 0 disables the limit.
+    """
+    if budget_bytes <= 0:
+        return
+    keep = {Path(p) for p in keep}
+    for site in list(POOL.sites.values()):
+        if site.archive is not None and site.name != replacing:
+            keep |= _source_paths(site.archive.src)
+    entries = []
+    sidecars = {".zip": lambda p: [p.with_suffix(".sha256")], ".part": lambda p: [Path(f"{p}.blocks")]}
+    for path in [*cache_dir.glob("*.zip"), *cache_dir.glob("*.index.json"), *cache_dir.glob("*.part")]:
+        files = [path, *sidecars.get(path.suffix, lambda p: [])(path)]
+        try:
+            entries.append((path.stat().st_mtime, path, files, sum(_disk_bytes(f) for f in files if f.exists())))
+        except FileNotFoundError:
+            continue
+    total = sum(e[3] for e in entries)
+    for _, path, files, size in sorted(entries, key=lambda e: e[0]):
+        if total <= budget_bytes:
+            break
+        if path in keep:
+            continue
+        # Mapped elsewhere (a --workers child that has not swapped yet), the bytes stay
+        # readable until it lets go; only the name disappears.
+        for f in files:
+            f.unlink(missing_ok=True)
+        total -= size
+        print(f"Archive cache: removed {path.name} ({size} bytes; cache now {total}/{budget_bytes} bytes)")
+
+def _write_text_atomic(path: Path, text: str) -> None:
+    tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
 
-def load_zip_into_memory(data: bytes):
-    global ZIP, ZIP_SET, ETAG
-    zf = zipfile.ZipFile(io.BytesIO(data), "r")
-    ZIP = zf
-    ZIP_SET = build_index(zf)
-    import hashlib
-    ETAG = 'W/"%s"' % hashlib.sha256(data).hexdigest()[:32]
-    print(f"Loaded ZIP with {len(ZIP_SET)} entries.")
+def _write_json_atomic(path: Path, obj) -> None:
+    _write_text_atomic(path, json.dumps(obj))
+
+# ==============================
+# Incremental sites (an index object over several pack zips)
+# ==============================
+
+# `publish.py --incremental` shares a small JSON index instead of a zip:
+#   {"format": INDEX_FORMAT, "packs": [pack share URL, ...], "files": {path: pack number},
+#    "fingerprinted": [path, ...]}
+# Each publish uploads only the changed files as a new pack; the gateway stitches the
+# packs into one archive, so everything past loading is unaware of it.
+INDEX_FORMAT = "wackamole-index/1"
+
+# object id → source of a pack in use, so a republish reuses the packs it shares.
+_PACK_SOURCES: "weakref.WeakValueDictionary[str, object]" = weakref.WeakValueDictionary()
+
+def _is_index(err: NotAZipError) -> bool:
+    return err.head.lstrip()[:1] == b"{"
+
+def fetch_index(site: Site, runner: _LoopThread, args, data: bytes | None = None) -> dict:
+    # `data` is the index when the zip download already read it (NotAZipError.data).
+    if data is None:
+        sink = runner.run(fetch_zip_via_sdk(
+            site.share_url,
+            site.indexd,
+            no_auth=args.no_auth,
+            env_path=args.env,
+            auth_fallback=args.auth_fallback,
+            expect_zip=False,
+            site_name=f"{site.name}#index"
+        ))
+        data = bytes(sink.getbuffer())
+    try:
+        index = json.loads(data)
+    except ValueError as e:
+        raise RuntimeError(f"Site {site.name!r}: share is neither a ZIP nor a site index ({e}).")
+    if not isinstance(index, dict) or index.get("format") != INDEX_FORMAT:
+        fmt = index.get("format") if isinstance(index, dict) else None
+        raise RuntimeError(f"Site {site.name!r}: unsupported site index format {fmt!r}.")
+    return index
+
+def _pack_site(site: Site, n: int, share_url: str) -> Site:
+    return Site(f"{site.name}#pack{n}", share_url, site.indexd)
+
+def _pack_source(site: Site, n: int, share_url: str, runner: _LoopThread, args):
+    key = _share_object_id(share_url)
+    src = _PACK_SOURCES.get(key)
+    if src is not None:
+        return src
+    if args.lazy:
+        src = open_remote_source(
+            share_url,
+            site.indexd,
+            runner,
+            Path(args.lazy_cache_dir),
+            block_size=max(64, args.lazy_block_kib) << 10,
+            no_auth=args.no_auth,
+            env_path=args.env,
+            auth_fallback=args.auth_fallback
+        )
+    elif args.archive_cache:
+        src = MappedSource(_download_archive_file(_pack_site(site, n, share_url), runner, args,
+                                                  Path(args.archive_cache))[0])
+    else:
+        sink = runner.run(fetch_zip_via_sdk(
+            share_url,
+            site.indexd,
+            no_auth=args.no_auth,
+            env_path=args.env,
+            auth_fallback=args.auth_fallback,
+            site_name=_pack_site(site, n, share_url).name
+        ))
+        src = BufferSource(sink.getbuffer())
+    _PACK_SOURCES[key] = src
+    return src
+
+def _without_zip64(extra: bytes) -> bytes:
+    # The packs' own zip64 fields are rewritten for the new offsets.
+    out, i = b"", 0
+    while i + 4 <= len(extra):
+        tag, n = struct.unpack_from("<HH", extra, i)
+        if tag != 1:
+            out += extra[i:i + 4 + n]
+        i += 4 + n
+    return out
+
+def central_directory(infos, start: int) -> bytes:
+    """
+    Central directory and end records for `infos` (header offsets final), placed
+    `start` bytes into the archive: the records ZipFile writes on close, zip64 where
+    needed, built here so no zipfile internals are touched.
+    """
+    out = bytearray()
+    for info in infos:
+        size, csize, offset = info.file_size, info.compress_size, info.header_offset
+        zip64 = []
+        if size > zipfile.ZIP64_LIMIT or csize > zipfile.ZIP64_LIMIT:
+            zip64 += [size, csize]
+            size = csize = 0xFFFFFFFF
+        if offset > zipfile.ZIP64_LIMIT:
+            zip64.append(offset)
+            offset = 0xFFFFFFFF
+        extra = _without_zip64(info.extra)
+        version = 0
+        if zip64:
+            extra = struct.pack("<HH" + "Q" * len(zip64), 1, 8 * len(zip64), *zip64) + extra
+            version = 45
+        try:
+            name, flags = info.filename.encode("ascii"), info.flag_bits
+        except UnicodeEncodeError:
+            name, flags = info.filename.encode("utf-8"), info.flag_bits | 0x800
+        dt = info.date_time
+        out += struct.pack("<4s4B4HL2L5H2L", b"PK\x01\x02", max(version, info.create_version),
+                           info.create_system, max(version, info.extract_version), info.reserved, flags,
+                           info.compress_type, dt[3] << 11 | dt[4] << 5 | dt[5] // 2,
+                           (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2], info.CRC, csize, size, len(name),
+                           len(extra), len(info.comment), 0, info.internal_attr, info.external_attr,
+                           offset) + name + extra + info.comment
+    count, size, offset = len(infos), len(out), start
+    if count > 0xFFFF or offset > zipfile.ZIP64_LIMIT or size > zipfile.ZIP64_LIMIT:
+        end = start + len(out)
+        out += struct.pack("<4sQ2H2L4Q", b"PK\x06\x06", 44, 45, 45, 0, 0, count, count, size, offset)
+        out += struct.pack("<4sLQL", b"PK\x06\x07", 0, end, 1)
+        count, size, offset = min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(offset, 0xFFFFFFFF)
+    out += struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, count, count, size, offset, 0)
+    return bytes(out)
+
+def archive_from_index(index: dict, sources: list) -> SiteArchive:
+    """
+    Lay the packs end to end and append a central directory that lists, for every
+    path, the member in the pack the index assigns it to (its header offset shifted
+    by the pack's position). The result reads as one ordinary zip.
+    """
+    zips, bases, base = [], [], 0
+    for src in sources:
+        zips.append(zipfile.ZipFile(_SourceFile(src), "r"))
+        bases.append(base)
+        base += src.size
+    infos = []
+    for name, n in sorted(index.get("files", {}).items()):
+        if not isinstance(n, int) or not 0 <= n < len(zips):
+            raise RuntimeError(f"Site index maps {name!r} to pack {n!r}, which it does not list.")
+        try:
+            info = copy.copy(zips[n].getinfo(name))
+        except KeyError:
+            raise RuntimeError(f"Site index maps {name!r} to pack {n}, which does not contain it.")
+        info.header_offset += bases[n]
+        infos.append(info)
+    src = ConcatSource([*sources, BufferSource(central_directory(infos, base))])
+    digest = hashlib.sha256(json.dumps(index, sort_keys=True).encode("utf-8")).hexdigest()
+    return SiteArchive(zipfile.ZipFile(_SourceFile(src), "r"), src, 'W/"%s"' % digest[:32],
+                       recorded_fingerprints(index))
+
+def fetch_index_archive(site: Site, runner: _LoopThread, args, data: bytes | None = None) -> SiteArchive:
+    index = fetch_index(site, runner, args, data)
+    sources = [_pack_source(site, n, url, runner, args) for n, url in enumerate(index.get("packs", []))]
+    print(f"Site {site.name!r}: index with {len(index.get('files', {}))} files in {len(sources)} packs.")
+    return archive_from_index(index, sources)
+
+def resolve_index_file(site: Site, runner: _LoopThread, args, cache_dir: Path,
+                       data: bytes | None = None) -> tuple[Path, str]:
+    """
+    Download the packs of an index share into the archive cache and write the index
+    with their local paths next to them; archive_from_file() maps that like an archive.
+    """
+    index = fetch_index(site, runner, args, data)
+    packs = [str(_download_archive_file(_pack_site(site, n, url), runner, args, cache_dir)[0])
+             for n, url in enumerate(index.get("packs", []))]
+    digest = hashlib.sha256(json.dumps(index, sort_keys=True).encode("utf-8")).hexdigest()
+    path = cache_dir / f"{_share_object_id(site.share_url)}.index.json"
+    _write_json_atomic(path, {"index": index, "packs": packs})
+    return path, digest
+
+# ==============================
+# Pre-fork workers sharing one mapped archive
+# ==============================
+
+def _download_archive_file(site: Site, runner: _LoopThread, args, cache_dir: Path) -> tuple[Path, str]:
+    found = cached_archive_file(cache_dir, site.share_url)
+    if found:
+        print(f"Site {site.name!r}: using cached archive {found[0]} (no download).")
+        return found
+    try:
+        return download_to_cache(cache_dir, site, runner, args)
+    except NotAZipError as e:
+        if not _is_index(e):
+            raise
+        return resolve_index_file(site, runner, args, cache_dir, e.data)
+
+def _publish_worker_state(state_path: Path, site: Site, archive: Path, digest: str) -> None:
+    # Workers follow this file; rewriting it is how the parent hot-swaps every worker at once.
+    _write_json_atomic(state_path, {"share_url": site.share_url, "archive": str(archive), "digest": digest})
+
+def _state_files(archive: Path) -> set[Path]:
+    # A resolved index is served from its packs; all of them stay while workers map it.
+    if archive.suffix != ".json":
+        return {archive}
+    return {archive, *(Path(p) for p in json.loads(archive.read_text(encoding="utf-8"))["packs"])}
+
+def _map_worker_state(site: Site, state: dict) -> None:
+    site.share_url = state["share_url"]
+    POOL.install(site, archive_from_file(Path(state["archive"]), state["digest"]))
+    print(f"Worker {os.getpid()}: mapped {state['archive']} ({len(site.archive.files)} entries).")
+
+def _follow_worker_state(state_path: Path, interval: float, last_mtime: float | None) -> None:
+    site = POOL.single()
+    while True:
+        time.sleep(interval)
+        try:
+            try:
+                mtime = state_path.stat().st_mtime
+            except FileNotFoundError:
+                continue   # the parent is still downloading
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+            state = json.loads(state_path.read_text(encoding="utf-8"))
+            if site.archive is None:
+                _map_worker_state(site, state)
+                continue
+            if site.archive.etag == 'W/"%s"' % state["digest"][:32]:
+                continue
+            reload_site(site, state["share_url"], site.indexd,
+                        lambda _s: archive_from_file(Path(state["archive"]), state["digest"]))
+        except Exception as e:
+            print(f"WARN: worker {os.getpid()} could not follow {state_path}: {type(e).__name__}: {e}")
+
+def _init_worker(opts: dict) -> None:
+    """
+    Runs in each --workers child: map the archive the parent downloaded, then follow
+    swaps. Until the parent publishes the first state the worker answers /__ready with 503.
+    """
+    args = argparse.Namespace(**opts)
+    _apply_serving_options(args)
+    state_path = Path(args.worker_state)
+    last_mtime = None
+    if state_path.exists():
+        last_mtime = state_path.stat().st_mtime
+        _map_worker_state(POOL.single(), json.loads(state_path.read_text(encoding="utf-8")))
+    threading.Thread(target=_follow_worker_state, args=(state_path, min(2.0, args.watch_interval), last_mtime),
+                     name="worker-state", daemon=True).start()
+
+def run_workers(site: Site, runner: _LoopThread, args) -> None:
+    """
+    Pre-fork mode: download the archive once into a file, then start N uvicorn workers
+    that each map it read-only, so memory stays flat as workers are added. uvicorn's
+    supervisor restarts dead workers; a restarted worker just maps the file again.
+    """
+    cache_dir = Path(args.archive_cache or os.path.join(tempfile.gettempdir(), "wackamole-archives"))
+    state_path = cache_dir / f"workers-{args.port}.json"
+    # Workers must not map a previous run's archive while this one downloads.
+    state_path.unlink(missing_ok=True)
+
+    def first_load() -> None:
+        path, digest = _download_archive_file(site, runner, args, cache_dir)
+        _publish_worker_state(state_path, site, path, digest)
+        print(f"Published {path} to workers")
+        prune_archive_cache(cache_dir, args.archive_cache_mib << 20, _state_files(path))
+
+    def on_change(s: Site, share: str, indexd: str | None) -> None:
+        staged = Site(s.name, share, indexd or s.indexd)
+        new_path, new_digest = _download_archive_file(staged, runner, args, cache_dir)
+        s.share_url, s.indexd = staged.share_url, staged.indexd
+        _publish_worker_state(state_path, s, new_path, new_digest)
+        print(f"Hot swap {s.name!r}: published {new_path} to workers")
+        prune_archive_cache(cache_dir, args.archive_cache_mib << 20, _state_files(new_path))
+
+    watch = args.watch_manifest or args.control_url
+    # run_server() binds the port right away; the download runs meanwhile.
+    load_in_background(site, first_load,
+                       on_loaded=(lambda: start_watcher(args.watch_interval, None, on_change=on_change)) if watch else None)
+
+    os.environ[WORKER_ENV] = json.dumps({**vars(args), "worker_state": str(state_path)})
+    print(f"Starting {args.workers} workers sharing {state_path}")
+    print(f"Try: {'https' if args.ssl_certfile else 'http'}://{args.host}:{args.port}/")
+    run_server(f"{Path(__file__).stem}:app", args, workers=args.workers, app_dir=str(Path(__file__).parent.resolve()))
+
+def load_in_background(site: Site, load, on_loaded=None) -> threading.Thread:
+    """
+    Run `load()` off the main thread so the port is bound at once; it returns the
+    archive to install (or None when it hands the archive over itself). Failures are
+    kept in site.last_error for /__ready and retried with backoff.
+    """
+    def run() -> None:
+        delay = 1.0
+        while True:
+            sd_notify(f"STATUS=Loading archive for {site.name!r}")
+            t0 = time.monotonic()
+            try:
+                arc = load()
+            except Exception as e:
+                site.last_error = f"{type(e).__name__}: {e}"
+                sd_notify(f"STATUS=Load failed, retrying: {site.last_error}")
+                print(f"ERROR: loading {site.name!r} failed: {site.last_error}; retrying in {delay:.0f}s")
+                time.sleep(delay)
+                delay = min(60.0, delay * 2)
+                continue
+            site.last_error = None
+            if arc is not None:
+                POOL.install(site, arc)
+            print(f"Site {site.name!r} ready after {time.monotonic() - t0:.2f}s")
+            _mark_ready("loaded")
+            if on_loaded is not None:
+                on_loaded()
+            return
+
+    t = threading.Thread(target=run, name="archive-loader", daemon=True)
+    t.start()
+    return t
+
+def load_zip_into_memory(data: bytes) -> SiteArchive:
+    arc = archive_from_bytes(data)
+    POOL.install(POOL.single(), arc)
+    print(f"Loaded ZIP with {len(arc.files)} entries.")
+    return arc
+
+def load_zip_from_source(src) -> SiteArchive:
+    arc = archive_from_source(src)
+    POOL.install(POOL.single(), arc)
+    print(f"Opened ZIP lazily with {len(arc.files)} entries ({src.size} bytes).")
+    return arc
+
+def _fetch_site_archive(site: Site, runner: _LoopThread, args) -> SiteArchive:
+    try:
+        arc = _fetch_zip_archive(site, runner, args)
+    except NotAZipError as e:
+        if not _is_index(e):
+            raise
+        arc = fetch_index_archive(site, runner, args, e.data)
+    print(f"Site {site.name!r}: loaded {len(arc.files)} entries.")
+    # After the whole site is fetched: an index's packs arrive one by one.
+    if args.lazy:
+        prune_archive_cache(Path(args.lazy_cache_dir), args.lazy_cache_mib << 20, _source_paths(arc.src),
+                            replacing=site.name)
+    elif args.archive_cache:
+        prune_archive_cache(Path(args.archive_cache), args.archive_cache_mib << 20, _source_paths(arc.src),
+                            replacing=site.name)
+    return arc
+
+def _fetch_zip_archive(site: Site, runner: _LoopThread, args) -> SiteArchive:
+    if args.lazy:
+        src = open_remote_source(
+            site.share_url,
+            site.indexd,
+            runner,
+            Path(args.lazy_cache_dir),
+            block_size=max(64, args.lazy_block_kib) << 10,
+            no_auth=args.no_auth,
+            env_path=args.env,
+            auth_fallback=args.auth_fallback
+        )
+        head = bytes(src.read_at(0, 4))
+        if head != b"PK\x03\x04":
+            index = head[:1] == b"{" and src.size <= INDEX_MAX_BYTES
+            raise NotAZipError(head, bytes(src.read_at(0, src.size)) if index else None)
+        return archive_from_source(src)
+    if args.archive_cache:
+        cache_dir = Path(args.archive_cache)
+        arc = open_cached_archive(cache_dir, site.share_url)
+        if arc is not None:
+            print(f"Site {site.name!r}: using cached archive {arc.src.path} (no download).")
+            return arc
+        return archive_from_file(*download_to_cache(cache_dir, site, runner, args))
+    sink = runner.run(fetch_zip_via_sdk(
+        site.share_url,
+        site.indexd,
+        no_auth=args.no_auth,
+        env_path=args.env,
+        auth_fallback=args.auth_fallback,
+        site_name=site.name
+    ))
+    return archive_from_bytes(sink.getbuffer(), sink.hexdigest())
+
+def _site_from_source(name: str, source: str, indexd: str | None = None, hosts=()) -> Site:
+    # SOURCE is either a share URL or the path of a manifest.json written by publish.py.
+    if "://" in source:
+        return Site(name, source, indexd, hosts)
+    share, indexd_from_m = _load_manifest(Path(source))
+    if not share:
+        raise ValueError(f"site {name!r}: {source} is not a share URL or a manifest with a share_url")
+    site = Site(name, share, indexd or indexd_from_m, hosts)
+    site.manifest = Path(source)
+    return site
+
+# ==============================
+# Hot swap on republish
+# ==============================
+
+def _read_control(url: str) -> tuple[str | None, str | None]:
+    # The control endpoint returns a manifest-shaped document: {"share_url", "indexd_url"?}.
+    import urllib.request
+    with urllib.request.urlopen(url, timeout=15) as resp:
+        m = json.loads(resp.read().decode("utf-8"))
+    return m.get("share_url"), m.get("indexd_url")
+
+def _log_release(site_name: str, etag: str, swapped_at: float) -> None:
+    print(f"Hot swap {site_name!r}: old archive {etag} released "
+          f"{time.monotonic() - swapped_at:.2f}s after swap")
+
+def reload_site(site: Site, share_url: str, indexd: str | None, fetch) -> SiteArchive:
+    """
+    Download and index the new archive off the request path, then swap it in with a
+    single reference assignment. Requests already holding the old archive finish
+    against it; its release is logged once the last of them lets go.
+    """
+    t0 = time.monotonic()
+    staged = Site(site.name, share_url, indexd or site.indexd)
+    arc = fetch(staged)
+    ready = time.monotonic()
+    old = site.archive
+    site.share_url, site.indexd = staged.share_url, staged.indexd
+    POOL.install(site, arc)
+    swapped = time.monotonic()
+    print(f"Hot swap {site.name!r}: new archive {arc.etag} ({len(arc.files)} entries) "
+          f"built in {ready - t0:.2f}s, swapped in {(swapped - ready) * 1000:.3f} ms")
+    if old is not None and old is not arc:
+        weakref.finalize(old, _log_release, site.name, old.etag, swapped)
+        del old
+    return arc
+
+def _swap_or_defer(site: Site, share: str, indexd: str | None, fetch) -> None:
+    if site.archive is None:
+        # Not loaded (evicted, never requested or failing): the next request fetches the new share.
+        site.share_url, site.indexd = share, indexd or site.indexd
+        site.retry_delay = site.retry_at = 0.0
+        return
+    reload_site(site, share, indexd, fetch)
+
+def _watch_sites(interval: float, on_change) -> None:
+    mtimes: dict[str, float] = {}
+    while True:
+        time.sleep(interval)
+        for site in list(POOL.sites.values()):
+            try:
+                if site.control_url:
+                    share, indexd = _read_control(site.control_url)
+                elif site.manifest is not None:
+                    try:
+                        mtime = site.manifest.stat().st_mtime
+                    except FileNotFoundError:
+                        continue
+                    if mtimes.get(site.name) == mtime:
+                        continue
+                    mtimes[site.name] = mtime
+                    share, indexd = _load_manifest(site.manifest)
+                else:
+                    continue
+                if not share or share == site.share_url:
+                    continue
+                print(f"Hot swap {site.name!r}: new share detected, fetching in the background…")
+                on_change(site, share, indexd)
+            except Exception as e:
+                print(f"WARN: hot swap check for site {site.name!r} failed: {type(e).__name__}: {e}")
+
+def start_watcher(interval: float, fetch, on_change=None) -> threading.Thread:
+    """Poll manifests/control URLs; by default swap in `fetch(site)`'s archive on change."""
+    on_change = on_change or (lambda site, share, indexd: _swap_or_defer(site, share, indexd, fetch))
+    t = threading.Thread(target=_watch_sites, args=(interval, on_change), name="archive-watcher", daemon=True)
+    t.start()
+    return t
+
+def _load_sites(args) -> list[Site]:
+    """
+    Sites from --sites (JSON) and --site NAME=SOURCE. The JSON file is either a list
+    or {"sites": [...]} of {"name", "share" | "manifest", "indexd"?, "hosts"?, "control_url"?}.
+    """
+    sites = []
+    if args.sites:
+        cfg = json.loads(Path(args.sites).read_text(encoding="utf-8"))
+        for entry in (cfg.get("sites", []) if isinstance(cfg, dict) else cfg):
+            source = entry.get("share") or entry.get("manifest")
+            if not entry.get("name") or not source:
+                raise ValueError(f"site entry needs a name and a share or manifest: {entry!r}")
+            site = _site_from_source(entry["name"], source, entry.get("indexd"), entry.get("hosts", ()))
+            site.control_url = entry.get("control_url")
+            sites.append(site)
+    hosts: dict[str, list[str]] = {}
+    for spec in args.site_host:
+        name, sep, host = spec.partition("=")
+        if not sep:
+            raise ValueError(f"--site-host expects NAME=HOST, got {spec!r}")
+        hosts.setdefault(name, []).append(host)
+    for spec in args.site:
+        name, sep, source = spec.partition("=")
+        if not sep:
+            raise ValueError(f"--site expects NAME=SHARE_URL_OR_MANIFEST, got {spec!r}")
+        sites.append(_site_from_source(name, source, args.indexd))
+    for site in sites:
+        site.hosts += tuple(h.lower() for h in hosts.pop(site.name, ()))
+    if hosts:
+        raise ValueError(f"--site-host for unknown site(s): {', '.join(hosts)}")
+    return sites
+
+def _apply_serving_options(args) -> None:
+    # Shared by main() and --workers children, which receive the parent's args.
+    global CACHE, STREAM_THRESHOLD, CHUNK_SIZE, DOWNLOAD_INFLIGHT, SEGMENT_SIZE, EARLY_HINTS, DEFAULT_CACHE_CONTROL
+    EARLY_HINTS = args.early_hints
+    DEFAULT_CACHE_CONTROL = args.cache_control
+    CACHE_POLICIES[:] = [tuple(spec.split("=", 1)) for spec in args.cache_policy]
+    DOWNLOAD_INFLIGHT = max(1, args.download_inflight)
+    SEGMENT_SIZE = max(1, args.segment_mib) << 20
+    for spec in args.mime:
+        ext, _, mime = spec.partition("=")
+        MIME_TYPES[("." + ext.lstrip(".")).lower()] = mime
+    STREAM_THRESHOLD = max(0, args.stream_kib) << 10
+    CHUNK_SIZE = max(16, args.chunk_kib) << 10
+    CACHE = MemberCache(args.cache_mib << 20, pin_patterns=tuple(args.cache_pin),
+                        pin_max_bytes=args.cache_pin_kib << 10)
 
 def main():
     parser = argparse.ArgumentParser(description="Serve a static site from an indexd share URL (SDK-backed).")
@@ -392,12 +2564,147 @@ def main():
     parser.add_argument("--env", default=".env", help="Path to .env (used only if auth fallback is needed)")
     parser.add_argument("--host", default="127.0.0.1")
     parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Pre-fork N worker processes that share one memory-mapped archive")
+    parser.add_argument("--fake-indexd", action="store_true",
+                        help="Use the offline fake_indexd backend instead of indexd_ffi (see fake_indexd.py)")
     parser.add_argument("--no-auth", dest="no_auth", action="store_true", default=True,
                         help="Try to fetch using only the share URL without app approval (default: on)")
     parser.add_argument("--auth-fallback", dest="auth_fallback", action="store_true", default=True,
                         help="If no-auth fails, fall back to interactive auth (default: on)")
+    parser.add_argument("--cache-mib", type=int, default=64,
+                        help="Memory budget for decompressed members, pinned ones included, in MiB (0 disables the cache)")
+    parser.add_argument("--cache-pin", action="append", default=[], metavar="GLOB",
+                        help="Keep matching small members cached permanently, within half of --cache-mib "
+                             "(repeatable, e.g. 'css/*')")
+    parser.add_argument("--cache-control", default=DEFAULT_CACHE_CONTROL,
+                        help="Cache-Control for members no policy matches (fingerprinted names are always immutable)")
+    parser.add_argument("--cache-policy", action="append", default=[], metavar="GLOB=VALUE",
+                        help="Cache-Control for members matching GLOB, first match wins "
+                             "(repeatable, e.g. 'media/*=public, max-age=86400')")
+    parser.add_argument("--cache-pin-kib", type=int, default=64,
+                        help="Largest member size eligible for pinning, in KiB")
+    parser.add_argument("--stream-kib", type=int, default=1024,
+                        help="Members larger than this (KiB) are streamed in chunks instead of buffered")
+    parser.add_argument("--chunk-kib", type=int, default=256,
+                        help="Chunk size for streamed responses, in KiB")
+    parser.add_argument("--download-inflight", type=int, default=6,
+                        help="Concurrent range reads when downloading an archive")
+    parser.add_argument("--segment-mib", type=int, default=8,
+                        help="Segment size for parallel archive downloads, in MiB")
+    parser.add_argument("--lazy", action="store_true",
+                        help="Fetch only the zip's central directory at startup; fetch members on demand")
+    parser.add_argument("--lazy-cache-dir", default=os.path.join(tempfile.gettempdir(), "wackamole-lazy"),
+                        help="Where lazily fetched archive ranges are cached")
+    parser.add_argument("--lazy-cache-mib", type=int, default=4096,
+                        help="Disk budget for --lazy-cache-dir; the least recently used range files no site "
+                             "is serving are deleted beyond it (0 = unlimited)")
+    parser.add_argument("--lazy-block-kib", type=int, default=1024,
+                        help="Granularity of lazy ranged fetches, in KiB")
+    parser.add_argument("--archive-cache", default=None, metavar="DIR",
+                        help="Keep downloaded archives here (keyed by share object ID, SHA-256 verified) "
+                             "and serve them via mmap; restarts skip the download")
+    parser.add_argument("--archive-cache-mib", type=int, default=4096,
+                        help="Disk budget for --archive-cache (and --workers archives); the least recently "
+                             "used archives no site is serving are deleted beyond it (0 = unlimited)")
+    parser.add_argument("--early-hints", action="store_true",
+                        help="Send preload Link headers as a 103 Early Hints response too (needs --http2)")
+    parser.add_argument("--http2", action="store_true",
+                        help="Serve HTTP/2 via uvicorn's zttp protocol (pip install zttp); "
+                             "browsers only use it over TLS, see --ssl-certfile")
+    parser.add_argument("--ssl-certfile", default=None, help="TLS certificate (PEM) to serve HTTPS")
+    parser.add_argument("--ssl-keyfile", default=None, help="TLS private key (PEM) for --ssl-certfile")
+    parser.add_argument("--mime", action="append", default=[], metavar="EXT=TYPE",
+                        help="Add or override a Content-Type by extension (repeatable, e.g. '.glb=model/gltf-binary')")
+    parser.add_argument("--sites", default=None,
+                        help="JSON file listing sites to serve from one process (multi-site mode)")
+    parser.add_argument("--site", action="append", default=[], metavar="NAME=SOURCE",
+                        help="Serve another site; SOURCE is a share URL or manifest path (repeatable)")
+    parser.add_argument("--site-host", action="append", default=[], metavar="NAME=HOST",
+                        help="Route requests for HOST to site NAME (repeatable; otherwise /NAME/ prefixes route)")
+    parser.add_argument("--pool-mib", type=int, default=1024,
+                        help="Memory budget for loaded archives in multi-site mode, in MiB (0 = unlimited)")
+    parser.add_argument("--watch-manifest", action="store_true",
+                        help="Hot-swap to a new archive when a site's manifest.json gets a new share_url")
+    parser.add_argument("--control-url", default=None,
+                        help="Poll this URL for a manifest-shaped JSON and hot-swap when its share_url changes "
+                             "(with --sites/--site: the --share site only; others take a \"control_url\" key)")
+    parser.add_argument("--watch-interval", type=float, default=15.0,
+                        help="Seconds between manifest/control checks")
     args = parser.parse_args()
 
+    # Windows event loop policy (helps some async stacks)
+    if sys.platform.startswith("win"):
+        try:
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        except Exception:
+            pass
+
+    if args.early_hints and not args.http2:
+        # Only uvicorn's HTTP/2 protocol exposes the ASGI early-hint extension.
+        print("ERROR: --early-hints needs --http2.")
+        sys.exit(2)
+    if args.http2 and importlib.util.find_spec("zttp") is None:
+        print("ERROR: --http2 needs the zttp package (pip install zttp).")
+        sys.exit(2)
+    if args.ssl_keyfile and not args.ssl_certfile:
+        print("ERROR: --ssl-keyfile needs --ssl-certfile.")
+        sys.exit(2)
+    for spec in args.mime:
+        ext, sep, mime = spec.partition("=")
+        if not sep or not ext or not mime:
+            print(f"ERROR: --mime expects EXT=TYPE, got {spec!r}")
+            sys.exit(2)
+    for spec in args.cache_policy:
+        pattern, sep, value = spec.partition("=")
+        if not sep or not pattern or not value.strip():
+            print(f"ERROR: --cache-policy expects GLOB=VALUE, got {spec!r}")
+            sys.exit(2)
+    _apply_serving_options(args)
+
+    runner = _LoopThread()
+
+    try:
+        sites = _load_sites(args)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(2)
+    if sites and args.workers > 1:
+        print("ERROR: --workers is only supported when serving a single site.")
+        sys.exit(2)
+    if args.workers > 1 and args.lazy:
+        print("ERROR: --workers shares one downloaded archive between processes; drop --lazy.")
+        sys.exit(2)
+    if sites:
+        # Multi-site: archives are fetched on first request and kept in a bounded pool.
+        POOL.budget_bytes = max(0, args.pool_mib) << 20
+        POOL.loader = lambda site: _fetch_site_archive(site, runner, args)
+        if args.share:
+            sites.insert(0, Site("default", args.share, args.indexd))
+            sites[0].control_url = args.control_url
+        elif args.control_url:
+            print("ERROR: --control-url applies to the --share site; give other sites a "
+                  "\"control_url\" in the --sites file.")
+            sys.exit(2)
+        try:
+            for site in sites:
+                POOL.add(site)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            sys.exit(2)
+        for site in POOL.sites.values():
+            route = ", ".join(site.hosts) or f"/{site.name}/"
+            print(f"Site {site.name!r} → {route}")
+        if not args.watch_manifest:
+            for site in POOL.sites.values():
+                site.manifest = None    # a manifest source is then only read once
+        if any(s.manifest or s.control_url for s in POOL.sites.values()):
+            start_watcher(args.watch_interval, POOL.loader)
+        _mark_ready("loaded")   # archives load on first request
+        print(f"Try: {'https' if args.ssl_certfile else 'http'}://{args.host}:{args.port}/{next(iter(POOL.sites))}/")
+        run_server(app, args)
+        return
+
     # If no --share and manifest exists, load from manifest
     if not args.share:
         mpath = Path(args.manifest)
@@ -412,18 +2719,22 @@ def main():
         print("ERROR: Provide --share or ensure manifest.json exists with a share_url.")
         sys.exit(2)
 
-    # Fetch ZIP (no-auth first, with optional auth fallback)
-    data = asyncio.run(fetch_zip_via_sdk(
-        args.share,
-        args.indexd,
-        no_auth=args.no_auth,
-        env_path=args.env,
-        auth_fallback=args.auth_fallback
-    ))
-
-    load_zip_into_memory(data)
-    print(f"Try: http://{args.host}:{args.port}/")
-    uvicorn.run(app, host=args.host, port=args.port)
+    site = POOL.add(Site("default", args.share, args.indexd))
+    if args.watch_manifest:
+        site.manifest = Path(args.manifest)
+    site.control_url = args.control_url
+    if args.workers > 1:
+        run_workers(site, runner, args)
+        return
+    # Fetch ZIP (no-auth first, with optional auth fallback) while the server already
+    # answers /__live and /__ready; with --lazy only the central directory is fetched
+    # and members are pulled on first request.
+    fetch = lambda s: _fetch_site_archive(s, runner, args)
+    watch = args.watch_manifest or args.control_url
+    load_in_background(site, lambda: fetch(site),
+                       on_loaded=(lambda: start_watcher(args.watch_interval, fetch)) if watch else None)
+    print(f"Try: {'https' if args.ssl_certfile else 'http'}://{args.host}:{args.port}/")
+    run_server(app, args)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
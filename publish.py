@@ -37,16 +37,27 @@
 import asyncio
 from sys import stdin
 import argparse, os, sys, json, time, webbrowser, tempfile, zipfile, subprocess
+import fnmatch, hashlib, io, posixpath, re, struct, threading, zlib
+from collections import deque
+from contextlib import aclosing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from urllib.parse import unquote, urlparse
 from datetime import datetime, timedelta, timezone
 
 # Ensure we can import the generated indexd_ffi module + shared library
 sys.path.insert(0, str(Path(__file__).parent.resolve()))
 
-from indexd_ffi import (
-    generate_recovery_phrase, AppKey, AppMeta, Sdk,
-    UploadOptions, set_logger, Logger
-)
+if "--fake-indexd" in sys.argv or os.environ.get("WACKAMOLE_FAKE_INDEXD"):
+    from fake_indexd import (
+        generate_recovery_phrase, AppKey, AppMeta, Sdk,
+        UploadOptions, set_logger, Logger
+    )
+else:
+    from indexd_ffi import (
+        generate_recovery_phrase, AppKey, AppMeta, Sdk,
+        UploadOptions, set_logger, Logger
+    )
 
 try:
     from dotenv import load_dotenv
@@ -92,14 +103,545 @@ def _parse_app_id(value) -> bytes:
             return n.to_bytes(32, "big", signed=False)
     raise ValueError("Could not parse APP_ID into 32 bytes. Use 64-hex or base64.")
 
-def zip_directory(src_dir: Path) -> Path:
+# ---------- Asset fingerprinting ----------
+
+# Assets eligible for content-hash names. HTML keeps its URLs; JSON, icons and anything
+# else a script might request by a fixed path are left alone.
+FINGERPRINT_EXTS = {
+    ".css", ".js", ".mjs", ".svg", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif",
+    ".woff", ".woff2", ".ttf", ".otf", ".mp4", ".webm", ".mp3", ".ogg",
+}
+FINGERPRINT_HEX = 10
+
+# The renamed members are listed in the archive comment (and in an incremental index), so
+# gateways mark exactly those immutable instead of guessing from names:
+#   {"fingerprinted": [arcname, ...]}
+def fingerprint_comment(names) -> bytes:
+    """Archive comment listing the fingerprinted members; empty if there are none or it would not fit."""
+    if not names:
+        return b""
+    comment = json.dumps({"fingerprinted": sorted(names)}, separators=(",", ":")).encode("utf-8")
+    if len(comment) > 0xFFFF:
+        print(f"WARN: {len(names)} fingerprinted names do not fit in the archive comment; "
+              f"gateways will recognise them by their name.{FINGERPRINT_HEX} hex.ext pattern instead.")
+        return b""
+    return comment
+
+_HTML_REF = re.compile(r"""(\b(?:src|href|poster|data-src)\s*=\s*)(["'])([^"']+)\2""", re.I)
+_SRCSET_REF = re.compile(r"""(\bsrcset\s*=\s*)(["'])([^"']+)\2""", re.I)
+_CSS_URL = re.compile(r"""(url\(\s*)(["']?)([^"')]+)\2(\s*\))""", re.I)
+_CSS_IMPORT = re.compile(r"""(@import\s+)(["'])([^"']+)\2""", re.I)
+
+def _file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class Fingerprinter:
+    """
+    Renames assets referenced from HTML/CSS to name.<hash>.ext and rewrites those
+    references. CSS is rewritten before it is hashed, so a changed image also gives
+    the stylesheet that uses it a new name. JS string literals are not rewritten,
+    which is why only referenced assets are renamed.
+    """
+
+    def __init__(self, src_dir: Path):
+        self.src_dir = src_dir
+        self.files = {p.relative_to(src_dir).as_posix(): p for p in src_dir.rglob("*") if p.is_file()}
+        self.renames: dict[str, str] = {}       # old path → fingerprinted path
+        self.rewritten: dict[str, bytes] = {}   # path → contents with references rewritten
+        self._active: set[str] = set()
+
+    def run(self) -> "Fingerprinter":
+        # Pages first: they decide what gets renamed. Stylesheets no page reaches are
+        # still rewritten afterwards (without a rename) so their own references resolve.
+        for rel in sorted(self.files):
+            if posixpath.splitext(rel)[1].lower() in (".html", ".htm"):
+                self._rewrite(rel, html=True)
+        for rel in sorted(self.files):
+            if rel.lower().endswith(".css") and rel not in self.rewritten:
+                self._rewrite(rel, html=False)
+        return self
+
+    def _target(self, page: str, url: str) -> str | None:
+        u = urlparse(url)
+        if u.scheme or u.netloc or not u.path:
+            return None
+        base = "" if u.path.startswith("/") else posixpath.dirname(page)
+        target = posixpath.normpath(posixpath.join(base, unquote(u.path).lstrip("/")))
+        return target if target in self.files else None
+
+    def _new_url(self, page: str, url: str) -> str:
+        target = self._target(page, url)
+        if target is None or posixpath.splitext(target)[1].lower() not in FINGERPRINT_EXTS:
+            return url
+        new = self._fingerprint(target)
+        if new is None:
+            return url
+        # Only the last path segment changes, so the URL keeps its own form and encoding.
+        cut = min([i for i in (url.find("?"), url.find("#")) if i >= 0] or [len(url)])
+        path, rest = url[:cut], url[cut:]
+        stem, dot, ext = path.rpartition(".")
+        return f"{stem}.{new.rsplit('.', 2)[-2]}{dot}{ext}{rest}"
+
+    def _rewrite(self, rel: str, *, html: bool) -> bytes:
+        text = self.files[rel].read_bytes().decode("utf-8", "surrogateescape")
+        sub = lambda m: m.group(1) + m.group(2) + self._new_url(rel, m.group(3)) + m.group(2)
+        if html:
+            text = _HTML_REF.sub(sub, text)
+            text = _SRCSET_REF.sub(lambda m: m.group(1) + m.group(2) + ", ".join(
+                " ".join([self._new_url(rel, c.split()[0])] + c.split()[1:])
+                for c in m.group(3).split(",") if c.strip()) + m.group(2), text)
+        text = _CSS_URL.sub(lambda m: m.group(1) + m.group(2) + self._new_url(rel, m.group(3).strip())
+                            + m.group(2) + m.group(4), text)
+        text = _CSS_IMPORT.sub(sub, text)
+        data = text.encode("utf-8", "surrogateescape")
+        self.rewritten[rel] = data
+        return data
+
+    def _fingerprint(self, rel: str) -> str | None:
+        if rel in self.renames:
+            return self.renames[rel]
+        if rel in self._active:
+            return None   # @import cycle: leave the inner reference as written
+        self._active.add(rel)
+        try:
+            if rel.lower().endswith(".css"):
+                digest = hashlib.sha256(self._rewrite(rel, html=False)).hexdigest()
+            else:
+                digest = _file_hash(self.files[rel])
+        finally:
+            self._active.discard(rel)
+        stem, ext = posixpath.splitext(rel)
+        self.renames[rel] = f"{stem}.{digest[:FINGERPRINT_HEX]}{ext}"
+        return self.renames[rel]
+
+# ---------- Compression policy ----------
+
+# Formats that are already compressed: deflating them costs CPU here and again in
+# every gateway that inflates them, for next to nothing. Stored members are also the
+# ones a gateway can serve as plain slices of the archive.
+STORE_EXTS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".heic", ".woff", ".woff2",
+    ".mp4", ".webm", ".mov", ".m4a", ".mp3", ".ogg", ".opus", ".flac",
+    ".zip", ".gz", ".tgz", ".br", ".zst", ".xz", ".bz2", ".7z", ".pdf",
+}
+MIN_RATIO = 1.05           # deflated members must shrink at least this much (original / compressed)
+RATIO_SAMPLE = 1 << 20     # bytes deflated to judge a member too large to hold in memory
+
+class CompressionPolicy:
+    """
+    Chooses each member's compression: the first matching --compress GLOB=LEVEL|store
+    rule, else STORED for STORE_EXTS, else DEFLATE at `level`. A deflated member that
+    comes out below min_ratio is stored instead.
+    """
+
+    def __init__(self, rules=(), level: int = 6, min_ratio: float = MIN_RATIO):
+        self.rules: list[tuple[str, int | None]] = list(rules)   # (glob, level, or None to store)
+        self.level = level
+        self.min_ratio = min_ratio
+
+    @staticmethod
+    def parse_rule(spec: str) -> tuple[str, int | None]:
+        glob, sep, value = spec.rpartition("=")
+        if not sep or not glob:
+            raise ValueError(f"--compress expects GLOB=LEVEL or GLOB=store, got {spec!r}")
+        if value.strip().lower() == "store":
+            return glob, None
+        if not value.strip().isdigit() or not 1 <= int(value) <= 9:
+            raise ValueError(f"--compress level must be 1-9 or 'store', got {value!r}")
+        return glob, int(value)
+
+    def choose(self, arcname: str) -> int | None:
+        """Deflate level for the member, or None to store it."""
+        for glob, level in self.rules:
+            if fnmatch.fnmatchcase(arcname, glob):
+                return level
+        if posixpath.splitext(arcname)[1].lower() in STORE_EXTS:
+            return None
+        return self.level
+
+class CompressionStats:
+    """Members, input bytes, archived bytes and deflate CPU seconds per outcome."""
+
+    OUTCOMES = ("deflated", "stored", "poor ratio")
+
+    def __init__(self):
+        self.totals = {o: [0, 0, 0, 0.0] for o in self.OUTCOMES}
+
+    def add(self, outcome: str, size: int, archived: int, cpu: float) -> None:
+        t = self.totals[outcome]
+        t[0] += 1
+        t[1] += size
+        t[2] += archived
+        t[3] += cpu
+
+    def report(self, min_ratio: float) -> str:
+        n, size, archived, cpu = self.totals["deflated"]
+        saved = size - archived
+        lines = [f"Compression: {n} deflated, {human_bytes(size)} → {human_bytes(archived)} "
+                 f"({'saved' if saved >= 0 else 'grew by'} {human_bytes(abs(saved))} for {cpu:.2f}s CPU"
+                 + (f", {human_bytes(saved / cpu)} per CPU-second)" if cpu and saved > 0 else ")")]
+        n, size, _, _ = self.totals["stored"]
+        lines.append(f"             {n} stored by type or rule ({human_bytes(size)}, no deflate CPU)")
+        n, size, _, cpu = self.totals["poor ratio"]
+        if n:
+            lines.append(f"             {n} stored after deflating below {min_ratio:g}x "
+                         f"({human_bytes(size)}, {cpu:.2f}s CPU spent)")
+        return "\n".join(lines)
+
+# ---------- Archive building ----------
+
+ZIP_JOBS = os.cpu_count() or 1    # processes deflating members (--jobs)
+PARALLEL_BATCH_BYTES = 4 << 20    # input bytes per pool task; small files travel together
+PARALLEL_MAX_MEMBER = 64 << 20    # larger members are deflated here, streaming from disk
+STREAM_QUEUE_CHUNKS = 4           # --stream: archive chunks buffered ahead of the upload
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0) # member timestamp unless SOURCE_DATE_EPOCH or --keep-mtimes
+
+def site_entries(src_dir: Path, fingerprints: Fingerprinter | None = None) -> list[tuple[str, Path, bytes | None]]:
+    """(arcname, source path, rewritten contents or None) for every file, in archive order."""
     assert src_dir.is_dir(), f"{src_dir} is not a directory"
-    tmp = Path(tempfile.gettempdir()) / f"site-{int(time.time())}.zip"
-    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for p in sorted(src_dir.rglob("*")):
-            if p.is_file():
-                z.write(p, arcname=str(p.relative_to(src_dir)))
-    return tmp
+    renames = fingerprints.renames if fingerprints else {}
+    rewritten = fingerprints.rewritten if fingerprints else {}
+    entries = []
+    for p in src_dir.rglob("*"):
+        if p.is_file():
+            rel = p.relative_to(src_dir).as_posix()
+            entries.append((renames.get(rel, rel), p, rewritten.get(rel)))
+    # Archive order follows the names stored in it, not the (renamed) source paths.
+    return sorted(entries, key=lambda e: e[0])
+
+def archive_date_time() -> tuple[int, ...]:
+    """Timestamp for every member: SOURCE_DATE_EPOCH when set (clamped to 1980), else ZIP_EPOCH."""
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if not epoch:
+        return ZIP_EPOCH
+    if not epoch.strip().isdigit():
+        raise ValueError(f"SOURCE_DATE_EPOCH must be a Unix timestamp, got {epoch!r}")
+    return time.gmtime(max(int(epoch), 315532800))[:6]
+
+def _member_info(arcname: str, p: Path, date_time: tuple | None) -> zipfile.ZipInfo:
+    if date_time is None:
+        return zipfile.ZipInfo.from_file(p, arcname=arcname)
+    # Reproducible header: fixed time, regular file rw-r--r--, Unix host, whatever the checkout.
+    info = zipfile.ZipInfo(arcname, date_time)
+    info.create_system = 3
+    info.external_attr = 0o100644 << 16
+    return info
+
+def _compress_member(path: str, data: bytes | None, level: int | None,
+                     min_ratio: float) -> tuple[int, int, str, bytes, float]:
+    """Also a pool task. Returns (CRC-32, size, outcome, stored or raw-deflate bytes, CPU seconds)."""
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    crc = zlib.crc32(data)
+    if level is None:
+        return crc, len(data), "stored", data, 0.0
+    t0 = time.process_time()
+    # The same raw deflate stream ZipFile.write produces at this level.
+    co = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = co.compress(data) + co.flush()
+    cpu = time.process_time() - t0
+    if len(compressed) * min_ratio > len(data):
+        return crc, len(data), "poor ratio", data, cpu
+    return crc, len(data), "deflated", compressed, cpu
+
+def _compress_batch(batch: list[tuple[str, bytes | None, int | None, float]]) -> list:
+    return [_compress_member(*item) for item in batch]
+
+_DATA_DESCRIPTOR = 0x08         # general purpose flag bits, as ZipFile sets them
+_UTF8_NAME = 0x800
+
+def _dos_time(dt: tuple) -> tuple[int, int]:
+    return dt[3] << 11 | dt[4] << 5 | dt[5] // 2, (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+
+def _encoded_name(info: zipfile.ZipInfo) -> tuple[bytes, int]:
+    try:
+        return info.filename.encode("ascii"), info.flag_bits
+    except UnicodeEncodeError:
+        return info.filename.encode("utf-8"), info.flag_bits | _UTF8_NAME
+
+class ZipWriter:
+    """
+    Writes members compressed beforehand (or deflated here while streaming from disk)
+    and owns the central directory, so no zipfile internals are touched. The layout
+    is the one ZipFile.writestr produces for the same ZipInfo and level, byte for
+    byte; scripts/bench_zip.py checks every build against a ZipFile reference. A
+    non-seekable dest gets data descriptors for streamed members, as ZipFile does.
+    """
+
+    def __init__(self, dest, comment: bytes = b""):
+        self.comment = comment        # archive comment, written after the central directory
+        self._owned = isinstance(dest, (str, os.PathLike))
+        self.fp = open(dest, "wb") if self._owned else dest
+        self.seekable = self.fp.seekable()
+        self.offset = self.fp.tell()
+        self.members: list[zipfile.ZipInfo] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self._write_central_directory()
+            self.fp.flush()
+        finally:
+            if self._owned:
+                self.fp.close()
+
+    def _write(self, b) -> None:
+        self.fp.write(b)
+        self.offset += len(b)
+
+    def _local_header(self, info: zipfile.ZipInfo, zip64: bool) -> bytes:
+        crc, csize, size = info.CRC, info.compress_size, info.file_size
+        if info.flag_bits & _DATA_DESCRIPTOR:
+            crc = csize = size = 0
+        extra = info.extra
+        if zip64:
+            extra += struct.pack("<HHQQ", 1, 16, size, csize)
+            size = csize = 0xFFFFFFFF
+            info.extract_version = max(info.extract_version, 45)
+            info.create_version = max(info.create_version, 45)
+        name, flags = _encoded_name(info)
+        return struct.pack("<4s2B4HL2L2H", b"PK\x03\x04", info.extract_version, info.reserved, flags,
+                           info.compress_type, *_dos_time(info.date_time), crc, csize, size,
+                           len(name), len(extra)) + name + extra
+
+    def add(self, info: zipfile.ZipInfo, crc: int, size: int, compress_type: int, payload: bytes) -> None:
+        """Append a member whose stored or raw-deflate payload is ready."""
+        info.compress_type, info.CRC, info.file_size, info.compress_size = compress_type, crc, size, len(payload)
+        info.flag_bits = 0
+        info.header_offset = self.offset
+        # Headers are final before the data is written, so streams need no data
+        # descriptors and get the same bytes as a file build.
+        self._write(self._local_header(info, zip64=size * 1.05 > zipfile.ZIP64_LIMIT))   # ZipFile's rule
+        self._write(payload)
+        self.members.append(info)
+
+    def add_stream(self, info: zipfile.ZipInfo, src, size: int, level: int | None) -> None:
+        """Append a member read from `src` in 1 MiB pieces, deflated here at `level` (None stores it)."""
+        info.compress_type = zipfile.ZIP_STORED if level is None else zipfile.ZIP_DEFLATED
+        info.CRC, info.file_size, info.compress_size = 0, size, 0
+        info.flag_bits = 0 if self.seekable else _DATA_DESCRIPTOR
+        info.header_offset = self.offset
+        zip64 = size * 1.05 > zipfile.ZIP64_LIMIT
+        self._write(self._local_header(info, zip64))
+        co = None if level is None else zlib.compressobj(level, zlib.DEFLATED, -15)
+        crc = size = csize = 0
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if co is not None:
+                chunk = co.compress(chunk)
+            csize += len(chunk)
+            self._write(chunk)
+        if co is not None:
+            tail = co.flush()
+            csize += len(tail)
+            self._write(tail)
+        info.CRC, info.file_size, info.compress_size = crc, size, csize
+        if not zip64 and max(size, csize) > zipfile.ZIP64_LIMIT:
+            raise RuntimeError(f"{info.filename} grew past 2 GiB while it was being archived")
+        if info.flag_bits & _DATA_DESCRIPTOR:
+            self._write(struct.pack("<LLQQ" if zip64 else "<LLLL", 0x08074B50, crc, csize, size))
+        else:
+            self.fp.seek(info.header_offset)
+            self.fp.write(self._local_header(info, zip64))
+            self.fp.seek(self.offset)
+        self.members.append(info)
+
+    def _write_central_directory(self) -> None:
+        start = self.offset
+        for info in self.members:
+            size, csize, offset = info.file_size, info.compress_size, info.header_offset
+            zip64 = []
+            if size > zipfile.ZIP64_LIMIT or csize > zipfile.ZIP64_LIMIT:
+                zip64 += [size, csize]
+                size = csize = 0xFFFFFFFF
+            if offset > zipfile.ZIP64_LIMIT:
+                zip64.append(offset)
+                offset = 0xFFFFFFFF
+            extra = info.extra
+            version = 0
+            if zip64:
+                extra = struct.pack("<HH" + "Q" * len(zip64), 1, 8 * len(zip64), *zip64) + extra
+                version = 45
+            name, flags = _encoded_name(info)
+            self._write(struct.pack("<4s4B4HL2L5H2L", b"PK\x01\x02", max(version, info.create_version),
+                                    info.create_system, max(version, info.extract_version), info.reserved,
+                                    flags, info.compress_type, *_dos_time(info.date_time), info.CRC, csize, size,
+                                    len(name), len(extra), len(info.comment), 0, info.internal_attr,
+                                    info.external_attr, offset) + name + extra + info.comment)
+        end = self.offset
+        count, size, offset = len(self.members), end - start, start
+        if count > 0xFFFF or offset > zipfile.ZIP64_LIMIT or size > zipfile.ZIP64_LIMIT:
+            self._write(struct.pack("<4sQ2H2L4Q", b"PK\x06\x06", 44, 45, 45, 0, 0, count, count, size, offset))
+            self._write(struct.pack("<4sLQL", b"PK\x06\x07", 0, end, 1))
+            count, size, offset = min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(offset, 0xFFFFFFFF)
+        self._write(struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, count, count, size, offset,
+                                len(self.comment)) + self.comment)
+
+def _append_member(z: ZipWriter, info: zipfile.ZipInfo, crc: int, size: int, outcome: str,
+                   payload: bytes, cpu: float, stats: CompressionStats) -> None:
+    z.add(info, crc, size, zipfile.ZIP_DEFLATED if outcome == "deflated" else zipfile.ZIP_STORED, payload)
+    stats.add(outcome, size, len(payload), cpu)
+
+def _write_large(z: ZipWriter, info: zipfile.ZipInfo, p: Path, level: int | None,
+                 policy: CompressionPolicy, stats: CompressionStats) -> None:
+    # Streamed from disk; the ratio check deflates only a leading sample.
+    cpu = 0.0
+    outcome = "stored" if level is None else "deflated"
+    if level is not None:
+        t0 = time.process_time()
+        with open(p, "rb") as f:
+            sample = f.read(RATIO_SAMPLE)
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        if len(co.compress(sample) + co.flush()) * policy.min_ratio > len(sample):
+            outcome = "poor ratio"
+        cpu = time.process_time() - t0
+    t0 = time.process_time()
+    with open(p, "rb") as src:
+        z.add_stream(info, src, p.stat().st_size, level if outcome == "deflated" else None)
+    if outcome == "deflated":
+        cpu += time.process_time() - t0
+    stats.add(outcome, info.file_size, info.compress_size, cpu)
+
+def _entry_size(entry) -> int:
+    _, p, data = entry
+    return len(data) if data is not None else p.stat().st_size
+
+def _is_large(entry) -> bool:
+    # Rewritten contents are in memory already; only files on disk are streamed.
+    return entry[2] is None and _entry_size(entry) > PARALLEL_MAX_MEMBER
+
+def _batches(plan):
+    """
+    Consecutive (entry, level) pairs grouped as (batch, pooled). Members to store or too
+    large to hold in memory come alone and unpooled; they are written in this process.
+    """
+    batch, batch_bytes = [], 0
+    for entry, level in plan:
+        if level is None or _is_large(entry):
+            if batch:
+                yield batch, True
+            batch, batch_bytes = [], 0
+            yield [(entry, level)], False
+            continue
+        batch.append((entry, level))
+        batch_bytes += _entry_size(entry)
+        if batch_bytes >= PARALLEL_BATCH_BYTES:
+            yield batch, True
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch, True
+
+def _write_inline(z, entry, level, policy: CompressionPolicy, stats: CompressionStats, date_time) -> None:
+    arcname, p, data = entry
+    info = _member_info(arcname, p, date_time)
+    if _is_large(entry):
+        _write_large(z, info, p, level, policy, stats)
+    else:
+        _append_member(z, info, *_compress_member(str(p), data, level, policy.min_ratio), stats)
+
+def _write_parallel(z: ZipWriter, plan, jobs: int, policy: CompressionPolicy, stats: CompressionStats,
+                    date_time) -> None:
+    # Members are deflated out of order in the pool but appended in entry order, so the
+    # archive matches the serial one. A bounded window of tasks keeps memory in check.
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        tasks = _batches(plan)
+        window = deque()
+
+        def fill():
+            while len(window) < 2 * jobs:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                batch, pooled = task
+                fut = pool.submit(_compress_batch, [(str(p), data, level, policy.min_ratio)
+                                                    for (_, p, data), level in batch]) if pooled else None
+                window.append((batch, fut))
+
+        fill()
+        while window:
+            batch, fut = window.popleft()
+            fill()
+            if fut is None:
+                _write_inline(z, *batch[0], policy, stats, date_time)    # the pool keeps working meanwhile
+                continue
+            for ((arcname, p, _), _), result in zip(batch, fut.result()):
+                _append_member(z, _member_info(arcname, p, date_time), *result, stats)
+
+def write_zip(entries, dest, jobs: int = 1, policy: CompressionPolicy | None = None,
+              stats: CompressionStats | None = None, date_time: tuple | None = ZIP_EPOCH,
+              comment: bytes = b"") -> CompressionStats:
+    """
+    Write entries to dest (a path or a writable file) under the compression policy;
+    jobs > 1 deflates in a process pool with identical output. Every member gets
+    date_time (None keeps file mtimes), so the same site always gives the same bytes.
+    """
+    policy = policy or CompressionPolicy()
+    stats = stats if stats is not None else CompressionStats()
+    plan = [(entry, policy.choose(entry[0])) for entry in entries]
+    with ZipWriter(dest, comment) as z:
+        if jobs > 1 and len(plan) > 1:
+            _write_parallel(z, plan, jobs, policy, stats, date_time)
+        else:
+            for entry, level in plan:
+                _write_inline(z, entry, level, policy, stats, date_time)
+    return stats
+
+# ---------- Incremental publishing ----------
+
+# With --incremental only new or changed files are uploaded, as a new "pack" zip. The
+# share URL then points at a small JSON index instead of a zip; gateways resolve it and
+# serve the packs together as one site:
+#   {"format": INDEX_FORMAT, "packs": [pack share URL, ...], "files": {path: pack number},
+#    "fingerprinted": [path, ...]}
+INDEX_FORMAT = "wackamole-index/1"
+
+def hash_entries(entries) -> dict[str, dict]:
+    files = {}
+    for arcname, p, data in entries:
+        if data is None:
+            files[arcname] = {"sha256": _file_hash(p), "size": p.stat().st_size}
+        else:
+            files[arcname] = {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+    return files
+
+def previous_manifest(path: Path, indexd_url: str) -> dict:
+    try:
+        prev = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    # Packs only resolve on the node they were uploaded to.
+    if not isinstance(prev, dict) or prev.get("indexd_url") != indexd_url:
+        return {}
+    return prev
+
+def plan_delta(files: dict, prev: dict, repack: bool = False) -> tuple[list[str], dict[str, int], list[dict]]:
+    """
+    Compares per-file hashes with the previous manifest. Returns the paths that need a
+    new pack, the path → pack number of everything an earlier pack still holds, and
+    those earlier packs (renumbered; packs nothing refers to any more are dropped).
+    """
+    old_packs = prev.get("packs") if isinstance(prev.get("packs"), list) else []
+    old_files = prev.get("files") if isinstance(prev.get("files"), dict) else {}
+    reuse = {}
+    if not repack:
+        for path, f in files.items():
+            old = old_files.get(path) or {}
+            pack = old.get("pack")
+            if old.get("sha256") == f["sha256"] and isinstance(pack, int) and 0 <= pack < len(old_packs):
+                reuse[path] = pack
+    live = sorted(set(reuse.values()))
+    renumber = {old: i for i, old in enumerate(live)}
+    changed = sorted(p for p in files if p not in reuse)
+    return changed, {p: renumber[n] for p, n in reuse.items()}, [dict(old_packs[n]) for n in live]
 
 def human_bytes(n: int) -> str:
     for unit in ['B','KiB','MiB','GiB','TiB','PiB']:
@@ -110,6 +652,392 @@ def human_bytes(n: int) -> str:
 async def maybe_await(value):
     return await value if asyncio.iscoroutine(value) else value
 
+# ---------- Upload ----------
+
+UPLOAD_MIN_CHUNK = 256 << 10      # bounds for the adaptive upload chunk (--chunk-mib is the start)
+UPLOAD_MAX_CHUNK = 16 << 20
+
+def erasure_coding(size: int, args) -> tuple[int, int]:
+    # Erasure-coding defaults by size, unless overridden
+    if args.data is not None and args.parity is not None:
+        return args.data, args.parity
+    if size <= 8 * 1024 * 1024:          # <= 8 MiB
+        return 3, 9
+    if size <= 64 * 1024 * 1024:         # <= 64 MiB
+        return 6, 12
+    return 10, 20
+
+class UploadProgress:
+    """progress_callback for UploadOptions: keeps the cumulative byte count the SDK reports."""
+
+    def __init__(self):
+        self.uploaded = 0
+        self.calls = 0
+
+    def progress(self, uploaded: int) -> None:
+        # May be called from an SDK thread; a plain int store is enough here.
+        self.uploaded = max(self.uploaded, int(uploaded))
+        self.calls += 1
+
+    __call__ = progress
+
+class ChunkSizer:
+    """
+    Adapts the upload chunk to the observed write latency: doubles it while writes
+    finish in under half the target, halves it when one takes twice as long.
+    """
+
+    def __init__(self, start: int, target: float, adaptive: bool = True):
+        # Only the adaptive range is bounded; a fixed size is used as given.
+        self.size = min(max(start, UPLOAD_MIN_CHUNK), UPLOAD_MAX_CHUNK) if adaptive else start
+        self.target = target
+        self.adaptive = adaptive
+        self.sizes_used: set[int] = set()
+
+    def observe(self, n: int, seconds: float) -> None:
+        self.sizes_used.add(n)
+        if not self.adaptive:
+            return
+        if seconds < self.target / 2 and n >= self.size:
+            self.size = min(UPLOAD_MAX_CHUNK, self.size * 2)
+        elif seconds > self.target * 2:
+            self.size = max(UPLOAD_MIN_CHUNK, self.size // 2)
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def upload_object(sdk, reader, size: int | None, metadata: dict, data_shards: int, parity_shards: int,
+                        args) -> tuple[object, int, str]:
+    """
+    Uploads everything `reader` yields; returns (finalized object, bytes sent, SHA-256).
+    The next chunk is read while the current one is written, and its size follows
+    the write latency (see ChunkSizer). size may be unknown (None).
+    """
+    progress = UploadProgress()
+    options = dict(max_inflight=args.inflight, data_shards=data_shards, parity_shards=parity_shards,
+                   metadata=json.dumps(metadata).encode("utf-8"))
+    try:
+        up = await sdk.upload(UploadOptions(**options, progress_callback=progress))
+    except TypeError:
+        # SDK builds that want a different callback type: count the bytes written instead.
+        up = await sdk.upload(UploadOptions(**options, progress_callback=None))
+
+    sizer = ChunkSizer(max(1, args.chunk_mib) * 1024 * 1024, args.target_write_ms / 1000,
+                       adaptive=not args.fixed_chunks)
+    sha = hashlib.sha256()
+    latencies: list[float] = []
+    stalled = 0.0
+    sent = 0
+    t_start = time.perf_counter()
+    pending = asyncio.ensure_future(reader.read(sizer.size))
+    try:
+        while True:
+            if not pending.done():
+                t0 = time.perf_counter()
+                await asyncio.wait([pending])
+                stalled += time.perf_counter() - t0     # the upload waited on disk or compression
+            chunk = pending.result()
+            if not chunk:
+                break
+            # Double buffering: the next read runs while this chunk is written.
+            pending = asyncio.ensure_future(reader.read(sizer.size))
+            sha.update(chunk)
+            t0 = time.perf_counter()
+            await up.write(chunk)
+            latencies.append(time.perf_counter() - t0)
+            sizer.observe(len(chunk), latencies[-1])
+            sent += len(chunk)
+            done = progress.uploaded if progress.calls else sent
+            rate = done / max(1e-9, time.perf_counter() - t_start)
+            of = f" / {human_bytes(size)} ({(done / size) * 100 if size else 100.0:.1f}%)" if size is not None else ""
+            print(f"\r{human_bytes(done)}{of} at {human_bytes(rate)}/s, chunk {human_bytes(sizer.size)}   ",
+                  end="", flush=True)
+    finally:
+        if not pending.done():
+            pending.cancel()
+    obj = await up.finalize()
+    elapsed = time.perf_counter() - t_start
+    print()
+    print(f"Upload: {human_bytes(sent)} in {elapsed:.1f}s ({human_bytes(sent / max(elapsed, 1e-9))}/s); "
+          f"{len(latencies)} writes of {human_bytes(min(sizer.sizes_used, default=0))}"
+          f"–{human_bytes(max(sizer.sizes_used, default=0))}")
+    print(f"        write latency p50 {_percentile(latencies, 0.5) * 1000:.0f} ms, "
+          f"p90 {_percentile(latencies, 0.9) * 1000:.0f} ms, p99 {_percentile(latencies, 0.99) * 1000:.0f} ms; "
+          f"stalled {stalled:.2f}s waiting for data"
+          + (f"; SDK reported {human_bytes(progress.uploaded)} uploaded" if progress.calls else ""))
+    return obj, sent, sha.hexdigest()
+
+class FileReader:
+    """Reads a file in a worker thread, so disk I/O overlaps the upload."""
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+
+    async def read(self, n: int) -> bytes:
+        return await asyncio.to_thread(self._file.read, n)
+
+    def close(self) -> None:
+        self._file.close()
+
+class BytesReader:
+    def __init__(self, data: bytes):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    async def read(self, n: int) -> bytes:
+        chunk = bytes(self._view[self._pos:self._pos + n])
+        self._pos += len(chunk)
+        return chunk
+
+class QueueWriter(io.RawIOBase):
+    """
+    Non-seekable file for ZipFile, run in a worker thread: it cuts the archive into
+    chunk_size pieces and puts them on an asyncio queue, blocking while it is full.
+    """
+
+    def __init__(self, loop, queue: asyncio.Queue, chunk_size: int):
+        self.loop = loop
+        self.queue = queue
+        self.chunk_size = chunk_size         # the consumer may change it between chunks
+        self.cancelled = threading.Event()   # set by the consumer when the upload gives up
+        self._buf = bytearray()
+        self._pos = 0
+
+    def writable(self): return True
+    def tell(self): return self._pos
+
+    def write(self, b) -> int:
+        # Whole members arrive in one call; cut them as they come so the buffer never
+        # holds more than one chunk next to the caller's bytes.
+        view = memoryview(b)
+        pos = 0
+        while pos < len(view):
+            take = max(0, self.chunk_size - len(self._buf))
+            self._buf += view[pos:pos + take]
+            pos += take
+            if len(self._buf) >= self.chunk_size:
+                self.put(bytes(self._buf))
+                self._buf.clear()
+        self._pos += len(view)
+        return len(view)
+
+    def put(self, item) -> None:
+        if self.cancelled.is_set():
+            raise RuntimeError("upload aborted; stopping the archive build")
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+
+    def finish(self) -> None:
+        if self._buf:
+            self.put(bytes(self._buf))
+            self._buf.clear()
+        self.put(None)
+
+class ArchiveStream:
+    """
+    Reader over an archive being built in a thread: chunks are handed over as they are
+    produced, so compression overlaps the upload and at most STREAM_QUEUE_CHUNKS are held.
+    """
+
+    def __init__(self, entries, jobs: int, policy: CompressionPolicy, stats: CompressionStats,
+                 date_time: tuple | None, comment: bytes = b""):
+        self._queue = asyncio.Queue(STREAM_QUEUE_CHUNKS)
+        self._writer = QueueWriter(asyncio.get_running_loop(), self._queue, UPLOAD_MIN_CHUNK)
+        self._done = False
+
+        def build():
+            try:
+                write_zip(entries, self._writer, jobs, policy, stats, date_time, comment)
+                self._writer.finish()
+            except BaseException as e:
+                if not self._writer.cancelled.is_set():
+                    self._writer.put(e)
+
+        self._builder = asyncio.ensure_future(asyncio.to_thread(build))
+
+    async def read(self, n: int) -> bytes:
+        if self._done:
+            return b""
+        self._writer.chunk_size = n    # applies from the next chunk the builder cuts
+        item = await self._queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        if item is None:
+            self._done = True
+            return b""
+        return item
+
+    async def aclose(self) -> None:
+        # Unblock a builder waiting on a full queue; its next write raises and it stops.
+        self._writer.cancelled.set()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        await self._builder
+
+async def upload_archive(sdk, entries, metadata: dict, args) -> tuple[object, int, str, int, int]:
+    """
+    Zips entries and uploads the archive; returns (object, archive size, archive
+    SHA-256, data shards, parity shards).
+    """
+    comment = fingerprint_comment([e[0] for e in entries if e[0] in args.fingerprinted])
+    if args.stream:
+        # The archive size is unknown until it is built; the input size stands in for it.
+        data_shards, parity_shards = erasure_coding(sum(_entry_size(e) for e in entries), args)
+        print(f"\nStreaming {metadata['filename']} into the upload "
+              f"(at most {STREAM_QUEUE_CHUNKS} chunks buffered)")
+        print(f"Using erasure coding: data={data_shards}, parity={parity_shards}, inflight={args.inflight}")
+        stats = CompressionStats()
+        async with aclosing(ArchiveStream(entries, args.jobs, args.compression, stats, args.date_time,
+                                                comment)) as reader:
+            obj, size, zip_sha256 = await upload_object(sdk, reader, None, metadata,
+                                                        data_shards, parity_shards, args)
+        print(stats.report(args.compression.min_ratio))
+        return obj, size, zip_sha256, data_shards, parity_shards
+
+    t0 = time.perf_counter()
+    zip_path = Path(tempfile.gettempdir()) / metadata["filename"]
+    stats = write_zip(entries, zip_path, args.jobs, args.compression, date_time=args.date_time, comment=comment)
+    size = zip_path.stat().st_size
+    print(f"\nCreated zip: {zip_path} ({human_bytes(size)}) in {time.perf_counter() - t0:.1f}s "
+          f"with {max(1, args.jobs)} process(es)")
+    print(stats.report(args.compression.min_ratio))
+
+    data_shards, parity_shards = erasure_coding(size, args)
+    print(f"Using erasure coding: data={data_shards}, parity={parity_shards}, inflight={args.inflight}")
+    print("Uploading to Sia via indexd…")
+    reader = FileReader(zip_path)
+    try:
+        obj, _, zip_sha256 = await upload_object(sdk, reader, size, metadata, data_shards, parity_shards, args)
+    finally:
+        reader.close()
+    return obj, size, zip_sha256, data_shards, parity_shards
+
+async def sealed_object_id(obj, app_key):
+    try:
+        if hasattr(obj, "seal"):
+            sealed = await maybe_await(obj.seal(app_key))
+            return getattr(sealed, "id", None)
+    except Exception:
+        pass
+    return None
+
+def _expires_before(item: dict, when: datetime) -> bool:
+    try:
+        return datetime.fromisoformat(item["valid_until"]) < when
+    except (KeyError, TypeError, ValueError):
+        return True
+
+async def refresh_share(sdk, pack: dict, valid_until: datetime, reshare_before: datetime) -> None:
+    """Re-shares a reused pack whose share URL expires before reshare_before, until valid_until."""
+    if not _expires_before(pack, reshare_before):
+        return
+    try:
+        obj = await maybe_await(sdk.object(pack["object_id"]))
+        pack["share_url"] = await maybe_await(sdk.share_object(obj, valid_until))
+        pack["valid_until"] = valid_until.isoformat()
+    except Exception as e:
+        print(f"WARN: could not re-share pack {pack.get('object_id')} ({e}); it stays valid until "
+              f"{pack.get('valid_until')}. Publish with --repack to upload a fresh copy.")
+
+def content_digest(files: dict, args) -> str:
+    """
+    SHA-256 over every file's hash plus the settings that shape the archive. Archives
+    are reproducible, so an equal digest means the previous upload is this site.
+    """
+    settings = {
+        "layout": "incremental" if args.incremental else "zip",
+        "date_time": args.date_time or "mtimes",
+        "compression": [args.compression.rules, args.compression.level, args.compression.min_ratio],
+    }
+    doc = {"files": {path: f["sha256"] for path, f in sorted(files.items())}, "archive": settings}
+    return hashlib.sha256(json.dumps(doc, sort_keys=True).encode("utf-8")).hexdigest()
+
+async def reuse_unchanged(sdk, prev: dict, valid_until: datetime, reshare_before: datetime) -> dict | None:
+    """Re-shares the previous manifest's object for an unchanged site; None when that is not possible."""
+    object_id = (prev.get("sealed_object") or {}).get("id")
+    if not object_id or not hasattr(sdk, "object"):
+        return None
+    # An index object lists its packs' share URLs; once one is close to expiry, publish
+    # a new index (publish_incremental re-shares just those packs).
+    if any(_expires_before(pack, reshare_before) for pack in prev.get("packs") or []):
+        return None
+    try:
+        obj = await maybe_await(sdk.object(object_id))
+        share_url = await maybe_await(sdk.share_object(obj, valid_until))
+    except Exception as e:
+        print(f"WARN: could not reuse object {object_id} ({e}); uploading again.")
+        return None
+    return {**prev, "share_url": share_url, "valid_until": valid_until.isoformat(), "uploaded_bytes": 0}
+
+async def publish_incremental(sdk, app_key, entries, files: dict, prev: dict, args, valid_until: datetime,
+                              reshare_before: datetime) -> dict:
+    changed, reuse, packs = plan_delta(files, prev, args.repack)
+    kept = len(files) - len(changed)
+    print(f"\nIncremental publish: {len(changed)} new or changed files, {kept} unchanged in {len(packs)} earlier packs")
+
+    for pack in packs:
+        await refresh_share(sdk, pack, valid_until, reshare_before)
+
+    uploaded = 0
+    ec = {}
+    if changed:
+        wanted = set(changed)
+        metadata = {
+            "type": "zip",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "filename": f"site-pack-{int(time.time())}.zip",
+            "content": "static-website-pack",
+        }
+        obj, size, zip_sha256, data_shards, parity_shards = await upload_archive(
+            sdk, [e for e in entries if e[0] in wanted], metadata, args)
+        ec = {"data_shards": data_shards, "parity_shards": parity_shards}
+        packs.append({
+            "share_url": await maybe_await(sdk.share_object(obj, valid_until)),
+            "valid_until": valid_until.isoformat(),
+            "object_id": await sealed_object_id(obj, app_key) or getattr(obj, "id", None),
+            "size": size,
+            "sha256": zip_sha256,
+        })
+        uploaded += size
+        for path in changed:
+            reuse[path] = len(packs) - 1
+
+    for path, f in files.items():
+        f["pack"] = reuse[path]
+    index = {
+        "format": INDEX_FORMAT,
+        "packs": [p["share_url"] for p in packs],
+        "files": {path: f["pack"] for path, f in sorted(files.items())},
+    }
+    if args.fingerprinted:
+        index["fingerprinted"] = sorted(args.fingerprinted)
+    index = json.dumps(index, sort_keys=True).encode("utf-8")
+    data_shards, parity_shards = erasure_coding(len(index), args)
+    metadata = {
+        "type": "site-index",
+        "format": INDEX_FORMAT,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "content": "static-website",
+        "hint": "Resolve the packs listed in this index and serve them as one site"
+    }
+    print("Uploading index…")
+    obj, _, _ = await upload_object(sdk, BytesReader(index), len(index), metadata, data_shards, parity_shards, args)
+    uploaded += len(index)
+    sealed_id = await sealed_object_id(obj, app_key)
+    print(f"Uploaded {human_bytes(uploaded)} (site total {human_bytes(sum(p['size'] for p in packs))})")
+
+    return {
+        "indexd_url": args.indexd_url,
+        "sealed_object": {"id": sealed_id} if sealed_id else {},
+        "share_url": await maybe_await(sdk.share_object(obj, valid_until)),
+        "valid_until": valid_until.isoformat(),
+        "zip_size_bytes": sum(p["size"] for p in packs),
+        "uploaded_bytes": uploaded,
+        "metadata": metadata,
+        "packs": packs,
+        "erasure_coding": {**ec, "max_inflight": args.inflight, "chunk_mib": args.chunk_mib},
+    }
+
 PLACEHOLDER_NAME = "PLACE STATIC SITE HERE.txt"
 
 def _site_flag_was_passed(argv: list[str]) -> bool:
@@ -182,14 +1110,65 @@ async def main():
     parser.add_argument("--logo-url", default=os.getenv("LOGO_URL"))
     parser.add_argument("--callback-url", default=os.getenv("CALLBACK_URL"))
     parser.add_argument("--share-days", type=int, default=365)
+    parser.add_argument("--reshare-days", type=float, default=None,
+                        help="Re-share reused packs whose links expire within this many days "
+                             "(default: half of --share-days)")
     parser.add_argument("--app-id", dest="app_id", default=os.getenv("APP_ID"))
     parser.add_argument("--seed-phrase", dest="seed_phrase", default=os.getenv("SEED_PHRASE"))
     parser.add_argument("--data", type=int, default=None)
     parser.add_argument("--parity", type=int, default=None)
     parser.add_argument("--inflight", type=int, default=6)
-    parser.add_argument("--chunk-mib", type=int, default=1)
+    parser.add_argument("--chunk-mib", type=int, default=1,
+                        help="Initial upload chunk size; it then adapts to write latency (default: 1)")
+    parser.add_argument("--target-write-ms", type=int, default=500,
+                        help="Write latency the adaptive chunk size aims for (default: 500)")
+    parser.add_argument("--fixed-chunks", action="store_true",
+                        help="Keep every upload chunk at --chunk-mib")
+    parser.add_argument("--fingerprint", action="store_true",
+                        help="Rename CSS/JS/images/fonts referenced from HTML or CSS to name.<hash>.ext "
+                             "and rewrite the references, so gateways can serve them as immutable")
+    parser.add_argument("--jobs", type=int, default=ZIP_JOBS,
+                        help="Processes compressing the archive (default: CPU count; 1 builds it serially)")
+    parser.add_argument("--compress", action="append", default=[], metavar="GLOB=LEVEL|store",
+                        help="Compression for members matching GLOB, checked in order before the built-in "
+                             "rules: a deflate level 1-9 or 'store' (repeatable)")
+    parser.add_argument("--compress-level", type=int, default=6,
+                        help="Deflate level for members no rule stores (1-9; default: 6)")
+    parser.add_argument("--min-ratio", type=float, default=MIN_RATIO,
+                        help=f"Store members that deflate to less than this ratio (original / compressed; "
+                             f"default: {MIN_RATIO}; 0 keeps every deflated member)")
+    parser.add_argument("--keep-mtimes", action="store_true",
+                        help="Store file modification times instead of one fixed timestamp "
+                             "(archives are then no longer reproducible)")
+    parser.add_argument("--always-upload", action="store_true",
+                        help="Upload even when the site is unchanged since the manifest at --out")
+    parser.add_argument("--stream", action="store_true",
+                        help="Upload the archive while it is being built, without a temp file; memory holds "
+                             "a few upload chunks plus the members being compressed (see README)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Upload only files whose hash changed since the manifest at --out, as a new pack, "
+                             "and share a small index object that gateways resolve")
+    parser.add_argument("--repack", action="store_true",
+                        help="With --incremental, put every file into one fresh pack instead of reusing earlier ones")
+    parser.add_argument("--fake-indexd", action="store_true",
+                        help="Use the offline fake_indexd backend instead of indexd_ffi (see fake_indexd.py)")
     args = parser.parse_args()
 
+    try:
+        if not 1 <= args.compress_level <= 9:
+            raise ValueError(f"--compress-level must be 1-9, got {args.compress_level}")
+        args.compression = CompressionPolicy([CompressionPolicy.parse_rule(spec) for spec in args.compress],
+                                             args.compress_level, args.min_ratio)
+        args.date_time = None if args.keep_mtimes else archive_date_time()
+        if args.reshare_days is None:
+            args.reshare_days = args.share_days / 2
+        if not 0 <= args.reshare_days < args.share_days:
+            raise ValueError(f"--reshare-days must be at least 0 and below --share-days ({args.share_days}), "
+                             f"got {args.reshare_days:g}")
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(2)
+
     site_flag_present = _site_flag_was_passed(sys.argv[1:])
     site_dir = Path(args.site_dir).resolve()
 
@@ -259,87 +1238,68 @@ async def main():
 
     # Prepare the zipped site archive
     # (site_dir may have been auto-populated above)
-    zip_path = zip_directory(site_dir)
-    size = zip_path.stat().st_size
-    print(f"\nCreated zip: {zip_path} ({human_bytes(size)})")
-
-    # Erasure-coding defaults by size, unless overridden
-    if args.data is None or args.parity is None:
-        if size <= 8 * 1024 * 1024:          # <= 8 MiB
-            data_shards, parity_shards = 3, 9
-        elif size <= 64 * 1024 * 1024:       # <= 64 MiB
-            data_shards, parity_shards = 6, 12
-        else:
-            data_shards, parity_shards = 10, 20
-    else:
-        data_shards, parity_shards = args.data, args.parity
+    fingerprints = None
+    if args.fingerprint:
+        fingerprints = Fingerprinter(site_dir).run()
+        print(f"Fingerprinted {len(fingerprints.renames)} assets "
+              f"(rewrote references in {len(fingerprints.rewritten)} HTML/CSS files)")
+    entries = site_entries(site_dir, fingerprints)
+    args.fingerprinted = set(fingerprints.renames.values()) if fingerprints else set()
+    files = hash_entries(entries)
+    now = datetime.now(timezone.utc)
+    valid_until = now + timedelta(days=args.share_days)
+    reshare_before = now + timedelta(days=args.reshare_days)
+    digest = content_digest(files, args)
+    prev = previous_manifest(Path(args.out_manifest), args.indexd_url)
 
-    print(f"Using erasure coding: data={data_shards}, parity={parity_shards}, inflight={args.inflight}")
-    
-    # Metadata
-    metadata = {
-        "type": "zip",
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "filename": zip_path.name,
-        "content": "static-website",
-        "hint": "Serve by unzipping in-memory or via ranged reads"
-    }
-    metadata_bytes = json.dumps(metadata).encode("utf-8")
-
-    # Start upload
-    print("Uploading to Sia via indexd…")
-    up = await sdk.upload(UploadOptions(
-        max_inflight=args.inflight,
-        data_shards=data_shards,
-        parity_shards=parity_shards,
-        metadata=metadata_bytes,
-        progress_callback=None
-    ))
-
-    sent = 0
-    chunk_size = max(1, args.chunk_mib) * 1024 * 1024
-    with open(zip_path, "rb") as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            await up.write(chunk)
-            sent += len(chunk)
-            pct = (sent / size) * 100 if size else 100.0
-            print(f"\r{human_bytes(sent)} / {human_bytes(size)} ({pct:.1f}%)", end="", flush=True)
-    print()
-    obj = await up.finalize()
+    manifest = None
+    if prev.get("content_sha256") == digest and not args.always_upload:
+        manifest = await reuse_unchanged(sdk, prev, valid_until, reshare_before)
+        if manifest is not None:
+            files = prev.get("files") or files    # same hashes, and it keeps their pack numbers
+            print(f"\nSite unchanged since the last publish (content {digest[:16]}…); "
+                  f"reused the uploaded object with a new share URL.")
+    if manifest is None and args.incremental:
+        manifest = await publish_incremental(sdk, app_key, entries, files, prev, args, valid_until, reshare_before)
+    elif manifest is None:
+        # Metadata
+        metadata = {
+            "type": "zip",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "filename": f"site-{int(time.time())}.zip",
+            "content": "static-website",
+            "hint": "Serve by unzipping in-memory or via ranged reads"
+        }
 
-    # Signed share URL
-    valid_until = datetime.now(timezone.utc) + timedelta(days=args.share_days)
-    signed_url = await maybe_await(sdk.share_object(obj, valid_until))
+        # Build and upload
+        obj, size, zip_sha256, data_shards, parity_shards = await upload_archive(sdk, entries, metadata, args)
 
-    sealed_id = None
-    try:
-        if hasattr(obj, "seal"):
-            sealed = await maybe_await(obj.seal(app_key))
-            sealed_id = getattr(sealed, "id", None)
-    except Exception:
-        pass
+        # Signed share URL
+        signed_url = await maybe_await(sdk.share_object(obj, valid_until))
+        sealed_id = await sealed_object_id(obj, app_key)
 
-    manifest = {
-        "indexd_url": args.indexd_url,
-        "sealed_object": {"id": sealed_id} if sealed_id else {},
-        "share_url": signed_url,
-        "valid_until": valid_until.isoformat(),
-        "zip_size_bytes": size,
-        "metadata": metadata,
-        "erasure_coding": {
-            "data_shards": data_shards,
-            "parity_shards": parity_shards,
-            "max_inflight": args.inflight,
-            "chunk_mib": args.chunk_mib,
+        manifest = {
+            "indexd_url": args.indexd_url,
+            "sealed_object": {"id": sealed_id} if sealed_id else {},
+            "share_url": signed_url,
+            "valid_until": valid_until.isoformat(),
+            "zip_size_bytes": size,
+            "zip_sha256": zip_sha256,
+            "metadata": metadata,
+            "erasure_coding": {
+                "data_shards": data_shards,
+                "parity_shards": parity_shards,
+                "max_inflight": args.inflight,
+                "chunk_mib": args.chunk_mib,
+            }
         }
-    }
+    manifest["content_sha256"] = digest
+    manifest["fingerprinted_assets"] = fingerprints.renames if fingerprints else {}
+    manifest["files"] = files
     Path(args.out_manifest).write_text(json.dumps(manifest, indent=2))
     print("\n✅ Upload complete.")
     print("Share URL (give this to a gateway):")
-    print(signed_url)
+    print(manifest["share_url"])
     print(f"\nWrote manifest to: {args.out_manifest}")
 
 if __name__ == "__main__":
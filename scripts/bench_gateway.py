@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Load-test the gateway against a synthetic site archive.
+
+Builds a zip of configurable shape (file count, size distribution, compressibility),
+loads it with gateway.load_zip_into_memory, then drives the app two ways:
+
+  inproc   ASGI calls straight into gateway.app (no sockets; measures the app itself)
+  socket   keep-alive HTTP/1.1 connections against uvicorn on a local port
+
+Each scenario (hit, index, miss, large, mixed) reports requests/s, p50/p99 latency
+and errors, plus the process RSS. Results can be saved as a baseline and compared
+against later runs; a regression beyond --tolerance exits with status 1.
+
+Usage:
+  python scripts/bench_gateway.py                                # both modes, default shape
+  python scripts/bench_gateway.py --mode inproc --requests 20000
+  python scripts/bench_gateway.py --save-baseline bench-main.json
+  python scripts/bench_gateway.py --baseline bench-main.json      # compare, exit 1 on regression
+  python scripts/bench_gateway.py --files 5000 --compressibility 0.2 --large-mib 64
+
+gateway.py imports indexd_ffi at module load; without the SDK built, run with
+WACKAMOLE_FAKE_INDEXD=1 (nothing here talks to indexd either way).
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import socket
+import sys
+import threading
+import time
+import zipfile
+
+# repo_root assumes this file is in ./scripts/
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+SCENARIOS = ("hit", "index", "miss", "large", "mixed")
+WORDS = ("mole gateway archive share object static site index deflate member cache "
+         "stream range header shard sector upload download publish manifest").split()
+
+# ---------- Synthetic archive ----------
+
+def _payload(rng: random.Random, size: int, compressibility: float) -> bytes:
+    """`size` bytes, roughly `compressibility` of them repetitive text and the rest random."""
+    text_len = int(size * compressibility)
+    words = []
+    n = 0
+    while n < text_len:
+        w = rng.choice(WORDS)
+        words.append(w)
+        n += len(w) + 1
+    text = " ".join(words).encode("ascii")[:text_len]
+    return text + rng.randbytes(size - len(text))
+
+def _member_size(rng: random.Random, args) -> int:
+    max_bytes = args.max_kib << 10
+    if args.size_dist == "fixed":
+        return args.median_kib << 10
+    if args.size_dist == "uniform":
+        return rng.randint(1, max_bytes)
+    # lognormal: most files small, a long tail up to --max-kib
+    return max(1, min(max_bytes, int(rng.lognormvariate(math.log(args.median_kib << 10), 1.0))))
+
+def build_archive(args) -> tuple[bytes, dict]:
+    """Returns (zip bytes, paths by scenario)."""
+    rng = random.Random(args.seed)
+    exts = (".html", ".css", ".js", ".json", ".svg", ".png")
+    buf = io.BytesIO()
+    paths = {"hit": [], "index": ["/"], "large": []}
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("index.html", _payload(rng, 4096, 0.9))
+        for d in range(args.dirs):
+            z.writestr(f"d{d}/index.html", _payload(rng, 4096, 0.9))
+            paths["index"].append(f"/d{d}/")
+        for i in range(args.files):
+            ext = exts[i % len(exts)]
+            # Images are already compressed; everything else follows --compressibility.
+            ratio = 0.0 if ext == ".png" else args.compressibility
+            name = f"d{i % max(1, args.dirs)}/f{i}{ext}"
+            z.writestr(name, _payload(rng, _member_size(rng, args), ratio))
+            paths["hit"].append("/" + name)
+        for i in range(args.large_files):
+            name = f"media/large{i}.bin"
+            z.writestr(name, _payload(rng, args.large_mib << 20, args.compressibility))
+            paths["large"].append("/" + name)
+    paths["miss"] = [f"/missing/{i}.html" for i in range(64)]
+    return buf.getvalue(), paths
+
+def scenario_paths(paths: dict, scenario: str, count: int, rng: random.Random) -> list[str]:
+    if scenario == "mixed":
+        # Roughly browser-shaped: mostly assets, some pages, a few misses and large files.
+        pools = [(paths["hit"], 0.80), (paths["index"], 0.12), (paths["miss"], 0.06), (paths["large"], 0.02)]
+        pools = [(p, w) for p, w in pools if p]
+        chosen = rng.choices([p for p, _ in pools], weights=[w for _, w in pools], k=count)
+        return [rng.choice(p) for p in chosen]
+    pool = paths[scenario]
+    return [rng.choice(pool) for _ in range(count)] if pool else []
+
+# ---------- Load generators ----------
+
+async def _inproc_request(app, path: str, headers: list) -> tuple[int, int]:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": headers, "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 80),
+    }
+    status, size = 0, 0
+    requested, done = False, asyncio.Event()
+
+    async def receive():
+        # One empty request body, then block until the response ends, like a real
+        # connection (streaming responses listen for http.disconnect meanwhile).
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+    return status, size
+
+async def run_inproc(app, paths: list[str], concurrency: int, headers: list) -> dict:
+    latencies, errors = [], 0
+    it = iter(paths)
+
+    async def worker():
+        nonlocal errors
+        for path in it:
+            t0 = time.perf_counter()
+            try:
+                status, _ = await _inproc_request(app, path, headers)
+                errors += status >= 500
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summary(latencies, errors, time.perf_counter() - t0)
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        k, _, v = line.partition(":")
+        headers[k.strip().lower()] = v.strip()
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            n = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(n + 2)
+            if n == 0:
+                break
+    return status
+
+async def run_socket(port: int, paths: list[str], concurrency: int, headers: list) -> dict:
+    latencies, errors = [], 0
+    it = iter(paths)
+    extra = "".join(f"{k.decode()}: {v.decode()}\r\n" for k, v in headers)
+
+    async def worker():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            for path in it:
+                t0 = time.perf_counter()
+                try:
+                    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n{extra}\r\n".encode())
+                    await writer.drain()
+                    errors += await _read_response(reader) >= 500
+                except Exception:
+                    errors += 1
+                    writer.close()
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                latencies.append(time.perf_counter() - t0)
+        finally:
+            writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summary(latencies, errors, time.perf_counter() - t0)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False))
+    thread = threading.Thread(target=server.run, name="bench-server", daemon=True)
+    thread.start()
+    deadline = time.time() + 15
+    while not server.started:
+        if time.time() > deadline or not thread.is_alive():
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.05)
+    return server, thread
+
+# ---------- Reporting ----------
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def _summary(latencies: list[float], errors: int, elapsed: float) -> dict:
+    lat = sorted(latencies)
+    return {
+        "requests": len(lat),
+        "errors": errors,
+        "rps": round(len(lat) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(lat, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(lat, 0.99) * 1000, 3),
+    }
+
+def rss_mib() -> dict:
+    """Current and peak resident set size of this process (server and client both live here)."""
+    out = {}
+    try:
+        with open("/proc/self/statm") as f:
+            out["rss_mib"] = round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20), 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        out["peak_rss_mib"] = round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+    except ImportError:
+        pass
+    return out
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print deltas against a saved baseline; returns the regressions."""
+    regressions = []
+    print(f"\nCompared with baseline ({baseline.get('created', '?')}, tolerance {tolerance:.0%}):")
+    for key, cur in results["runs"].items():
+        old = baseline.get("runs", {}).get(key)
+        if not old:
+            print(f"  {key:<16} (not in baseline)")
+            continue
+        d_rps = (cur["rps"] - old["rps"]) / old["rps"] if old["rps"] else 0.0
+        d_p99 = (cur["p99_ms"] - old["p99_ms"]) / old["p99_ms"] if old["p99_ms"] else 0.0
+        flag = ""
+        if d_rps < -tolerance or d_p99 > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"  {key:<16} rps {old['rps']:>9} → {cur['rps']:>9} ({d_rps:+.1%})  "
+              f"p99 {old['p99_ms']:>8} → {cur['p99_ms']:>8} ms ({d_p99:+.1%}){flag}")
+    return regressions
+
+# ---------- Main ----------
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load-test gateway.py against a synthetic archive.")
+    shape = parser.add_argument_group("archive shape")
+    shape.add_argument("--files", type=int, default=500, help="Number of regular files (default: 500)")
+    shape.add_argument("--dirs", type=int, default=20, help="Directories, each with an index.html (default: 20)")
+    shape.add_argument("--size-dist", choices=("lognormal", "uniform", "fixed"), default="lognormal",
+                       help="File size distribution (default: lognormal)")
+    shape.add_argument("--median-kib", type=int, default=8, help="Median (or fixed) file size in KiB (default: 8)")
+    shape.add_argument("--max-kib", type=int, default=512, help="Largest regular file in KiB (default: 512)")
+    shape.add_argument("--compressibility", type=float, default=0.7,
+                       help="Fraction of each text file that is repetitive, 0..1 (default: 0.7)")
+    shape.add_argument("--large-files", type=int, default=2, help="Large files for the 'large' scenario (default: 2)")
+    shape.add_argument("--large-mib", type=int, default=16, help="Size of each large file in MiB (default: 16)")
+    shape.add_argument("--seed", type=int, default=1, help="RNG seed, so runs are comparable (default: 1)")
+    load = parser.add_argument_group("load")
+    load.add_argument("--mode", choices=("inproc", "socket", "both"), default="both")
+    load.add_argument("--scenario", action="append", choices=SCENARIOS, default=[],
+                      help="Scenario to run (repeatable; default: all)")
+    load.add_argument("--requests", type=int, default=5000, help="Requests per scenario (default: 5000)")
+    load.add_argument("--large-requests", type=int, default=50,
+                      help="Requests for the 'large' scenario (default: 50)")
+    load.add_argument("--concurrency", type=int, default=32, help="Concurrent clients (default: 32)")
+    load.add_argument("--gzip", action="store_true", help="Send Accept-Encoding: gzip like a browser")
+    out = parser.add_argument_group("baselines")
+    out.add_argument("--save-baseline", metavar="PATH", help="Write the results as a JSON baseline")
+    out.add_argument("--baseline", metavar="PATH", help="Compare against a saved baseline")
+    out.add_argument("--tolerance", type=float, default=0.10,
+                     help="Allowed rps drop / p99 rise before a run counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    import gateway
+
+    t0 = time.perf_counter()
+    data, paths = build_archive(args)
+    print(f"Built synthetic archive: {len(data) / (1 << 20):.1f} MiB, "
+          f"{args.files + args.dirs + 1 + args.large_files} entries in {time.perf_counter() - t0:.2f}s")
+    t0 = time.perf_counter()
+    gateway.load_zip_into_memory(data)
+    del data
+    print(f"load_zip_into_memory: {time.perf_counter() - t0:.2f}s  {rss_mib()}")
+
+    headers = [(b"accept-encoding", b"gzip")] if args.gzip else []
+    scenarios = args.scenario or list(SCENARIOS)
+    modes = ("inproc", "socket") if args.mode == "both" else (args.mode,)
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        # Only settings that change the numbers; which modes/scenarios ran is per-run.
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("save_baseline", "baseline", "tolerance", "mode", "scenario")},
+        "runs": {},
+    }
+
+    server = None
+    for mode in modes:
+        if mode == "socket":
+            port = _free_port()
+            server, _ = start_server(gateway.app, port)
+        for scenario in scenarios:
+            rng = random.Random(f"{args.seed}-{scenario}")
+            count = args.large_requests if scenario == "large" else args.requests
+            plan = scenario_paths(paths, scenario, count, rng)
+            if not plan:
+                continue
+            conc = max(1, min(args.concurrency, len(plan)))
+            if mode == "inproc":
+                stats = asyncio.run(run_inproc(gateway.app, plan, conc, headers))
+            else:
+                stats = asyncio.run(run_socket(port, plan, conc, headers))
+            stats.update(rss_mib())
+            key = f"{mode}/{scenario}"
+            results["runs"][key] = stats
+            print(f"  {key:<16} {stats['requests']:>7} req  {stats['rps']:>9} req/s  "
+                  f"p50 {stats['p50_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms  "
+                  f"errors {stats['errors']}  rss {stats.get('rss_mib', '?')} MiB")
+        if server is not None:
+            server.should_exit = True
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"\nSaved baseline: {args.save_baseline}")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("config") != results["config"]:
+            print("WARN: baseline was recorded with a different archive shape or load settings.")
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
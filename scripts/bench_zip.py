@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Time publish.write_zip on a synthetic site, serially and with process pools.
+
+Generates a directory of files (count, sizes and compressibility configurable),
+builds the archive once per --jobs value, and reports seconds, MiB/s and speedup
+over the serial build. Every archive must be byte-identical to the serial one and
+to a reference built with zipfile.ZipFile.writestr from the same members under
+the same --compress rules, so both the writer and the compression policy in
+publish.py are checked against the standard library; a mismatch exits with
+status 1. Every eighth generated file is a .png, which the policy stores.
+
+Usage:
+  python scripts/bench_zip.py                       # 1, 2, 4, ... up to the CPU count
+  python scripts/bench_zip.py --files 20000 --jobs 1 --jobs 8
+  python scripts/bench_zip.py --site path/to/site   # time a real site instead
+  python scripts/bench_zip.py --stream-above-kib 256 # also cover members streamed from disk
+  python scripts/bench_zip.py --compress 'd0*=store' --min-ratio 2
+
+publish.py imports indexd_ffi at module load; this sets WACKAMOLE_FAKE_INDEXD=1
+first, so the SDK does not need to be built.
+"""
+
+from pathlib import Path
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+
+# repo_root assumes this file is in ./scripts/
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+os.environ.setdefault("WACKAMOLE_FAKE_INDEXD", "1")
+
+import publish  # noqa: E402
+
+WORDS = ("mole gateway archive share object static site index deflate member cache "
+         "stream range header shard sector upload download publish manifest").split()
+
+def build_site(root: Path, args) -> None:
+    rng = random.Random(args.seed)
+    for i in range(args.files):
+        size = max(1, int(rng.lognormvariate(0, 1.0) * (args.median_kib << 10)))
+        text_len = int(size * args.compressibility)
+        text = " ".join(rng.choice(WORDS) for _ in range(text_len // 6 + 1)).encode("ascii")[:text_len]
+        d = root / f"d{i % 64:02d}"
+        d.mkdir(parents=True, exist_ok=True)
+        (d / f"f{i}{'.png' if i % 8 == 0 else '.txt'}").write_bytes(text + rng.randbytes(size - len(text)))
+
+def reference_zip(entries, dest: Path, policy, date_time) -> None:
+    """
+    ZipFile.writestr build of the same members. Each is stored or deflated as the
+    policy says: its rule or extension, then the ratio check on the whole member (or
+    on the leading sample publish.py deflates for members it streams from disk).
+    """
+    with zipfile.ZipFile(dest, "w") as z:
+        for entry in entries:
+            arcname, p, data = entry
+            data = p.read_bytes() if data is None else data
+            level = policy.choose(arcname)
+            if level is not None:
+                sample = data[:publish.RATIO_SAMPLE] if publish._is_large(entry) else data
+                co = zlib.compressobj(level, zlib.DEFLATED, -15)
+                if len(co.compress(sample) + co.flush()) * policy.min_ratio > len(sample):
+                    level = None
+            z.writestr(publish._member_info(arcname, p, date_time), data,
+                       compress_type=zipfile.ZIP_STORED if level is None else zipfile.ZIP_DEFLATED,
+                       compresslevel=level)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark serial vs parallel archive building in publish.py.")
+    parser.add_argument("--site", help="Existing site directory (default: generate one)")
+    parser.add_argument("--files", type=int, default=5000, help="Generated files (default: 5000)")
+    parser.add_argument("--median-kib", type=int, default=16, help="Median generated file size in KiB (default: 16)")
+    parser.add_argument("--compressibility", type=float, default=0.8,
+                        help="Fraction of each generated file that is text (default: 0.8)")
+    parser.add_argument("--seed", type=int, default=1, help="RNG seed (default: 1)")
+    parser.add_argument("--jobs", type=int, action="append", default=[],
+                        help="Process count to time; repeatable (default: 1, 2, 4, ... CPU count)")
+    parser.add_argument("--compress", action="append", default=[], metavar="GLOB=LEVEL|store",
+                        help="Compression rule, as in publish.py (repeatable)")
+    parser.add_argument("--compress-level", type=int, default=6, help="Default deflate level (default: 6)")
+    parser.add_argument("--min-ratio", type=float, default=publish.MIN_RATIO,
+                        help=f"Store members that deflate below this ratio (default: {publish.MIN_RATIO})")
+    parser.add_argument("--stream-above-kib", type=int, default=None,
+                        help="Stream members larger than this from disk instead of pooling them "
+                             f"(default: {publish.PARALLEL_MAX_MEMBER >> 10})")
+    args = parser.parse_args()
+
+    if args.stream_above_kib is not None:
+        publish.PARALLEL_MAX_MEMBER = args.stream_above_kib << 10
+
+    jobs = args.jobs or sorted({1, *(2 ** k for k in range(1, 8) if 2 ** k <= publish.ZIP_JOBS), publish.ZIP_JOBS})
+    if 1 not in jobs:
+        jobs = [1, *jobs]
+
+    with tempfile.TemporaryDirectory(prefix="wackamole-bench-zip-") as tmp:
+        tmp = Path(tmp)
+        if args.site:
+            site = Path(args.site).resolve()
+        else:
+            site = tmp / "site"
+            print(f"Generating {args.files} files…")
+            build_site(site, args)
+        entries = publish.site_entries(site)
+        total = sum(p.stat().st_size for _, p, _ in entries)
+        print(f"{len(entries)} files, {publish.human_bytes(total)}, {publish.ZIP_JOBS} CPUs\n")
+        print(f"{'jobs':>5} {'seconds':>9} {'MiB/s':>8} {'speedup':>8}  archive")
+
+        policy = publish.CompressionPolicy([publish.CompressionPolicy.parse_rule(r) for r in args.compress],
+                                           args.compress_level, args.min_ratio)
+        date_time = publish.ZIP_EPOCH
+        serial_time = serial_digest = reference_digest = None
+        for n in jobs:
+            out = tmp / f"site-{n}.zip"
+            t0 = time.perf_counter()
+            publish.write_zip(entries, out, n, policy, date_time=date_time)
+            dt = time.perf_counter() - t0
+            digest = hashlib.sha256(out.read_bytes()).hexdigest()
+            if n == 1:
+                serial_time, serial_digest = dt, digest
+                reference_zip(entries, tmp / "reference.zip", policy, date_time)
+                reference_digest = hashlib.sha256((tmp / "reference.zip").read_bytes()).hexdigest()
+            if digest != reference_digest:
+                same = "DIFFERS from zipfile" + ("" if digest == serial_digest else " and serial")
+            else:
+                same = "identical to serial and zipfile"
+            print(f"{n:>5} {dt:>9.2f} {total / (1 << 20) / dt:>8.1f} {serial_time / dt:>7.2f}x  {same}")
+            out.unlink()
+            if digest != serial_digest or digest != reference_digest:
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()